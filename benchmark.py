@@ -0,0 +1,56 @@
+import argparse
+import json
+from benchmarks.standin import StandInServer
+from benchmarks.suite import BenchmarkSuite, BenchmarkOptions, SCENARIOS, compare
+
+def start():
+	defaults = BenchmarkOptions()
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-o', '--output', required=False, help='Path of the JSON result file.')
+	parser.add_argument('-b', '--baseline', required=False, help='Path of a previous JSON result file to compare with.')
+	parser.add_argument('-s', '--scenario', required=False, action='append', choices=SCENARIOS, help='Scenario to run, every scenario runs by default.')
+	parser.add_argument('--metadata-calls', type=int, default=defaults.metadata_calls, help='Number of get-resource calls.')
+	parser.add_argument('--blob-size', type=int, default=defaults.blob_size, help='Size of uploaded and downloaded blobs in bytes.')
+	parser.add_argument('--chunk-size', type=int, default=defaults.chunk_size, help='Upload chunk size in bytes.')
+	parser.add_argument('--adaptive-chunk-size', action='store_true', help='Tune the upload chunk size by the measured throughput, from scratch for every upload.')
+	parser.add_argument('--upload-workers', type=int, default=defaults.upload_workers, help='Concurrent chunk uploads.')
+	parser.add_argument('--transfer-repeat', type=int, default=defaults.transfer_repeat, help='Number of uploads and downloads.')
+	parser.add_argument('--tree-dirs', type=int, default=defaults.tree_dirs, help='Directories of the listed tree.')
+	parser.add_argument('--tree-blobs-per-dir', type=int, default=defaults.tree_blobs_per_dir, help='Blobs per directory of the listed tree.')
+	parser.add_argument('--changefeed-blobs', type=int, default=defaults.changefeed_blobs, help='Blobs of the changefeed snapshot.')
+	parser.add_argument('--changefeed-polls', type=int, default=defaults.changefeed_polls, help='Number of incremental changefeed polls.')
+	args = parser.parse_args()
+
+	options = BenchmarkOptions(
+		metadata_calls=args.metadata_calls,
+		blob_size=args.blob_size,
+		chunk_size=args.chunk_size,
+		adaptive_chunk_size=args.adaptive_chunk_size,
+		upload_workers=args.upload_workers,
+		transfer_repeat=args.transfer_repeat,
+		tree_dirs=args.tree_dirs,
+		tree_blobs_per_dir=args.tree_blobs_per_dir,
+		changefeed_blobs=args.changefeed_blobs,
+		changefeed_polls=args.changefeed_polls)
+
+	with StandInServer() as server:
+		suite = BenchmarkSuite(server, options)
+		try:
+			result = suite.run(args.scenario or SCENARIOS)
+		finally:
+			suite.close()
+
+	print(json.dumps(result['results'], indent=4))
+	if args.output:
+		with open(args.output, 'w', encoding='utf-8') as f:
+			json.dump(result, f, indent=4)
+
+	if args.baseline:
+		with open(args.baseline, 'r', encoding='utf-8') as f:
+			baseline = json.load(f)
+		print('\nChanges relative to the baseline:')
+		for key, change in compare(baseline, result).items():
+			print(f'{key}: {change:+.1%}')
+
+if __name__ == '__main__':
+	start()
@@ -0,0 +1,505 @@
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PROJECT_ROOT = 'Project Root'
+PROJECT_ROOT_ID = 'projectRoot'
+MODEL_SERVER_ID = 'standInModelServer'
+MAX_RESULT_LIMIT = 1000
+CONTENT_BUFFER_SIZE = 1024 * 1024
+
+class StandInError(Exception):
+	def __init__(self, code, message, status_code=430):
+		self.code = code
+		self.message = message
+		self.status_code = status_code
+
+class StandInState:
+	# In-memory Manager and Blob Server state. Blob Server blob ids and Manager blob resource ids are the same.
+	def __init__(self, server_url, job_polls=3):
+		self.lock = threading.Lock()
+		self.tokens = {}
+		self.sessions = set()
+		self.batches = {}
+		self.uploads = {}
+		self.contents = {}
+		self.jobs = {}
+		# Get job calls a job needs to complete.
+		self.job_polls = job_polls
+		self.revision = 0
+		self.changes = []
+		self.resources = {}
+		self.children = {}
+		self._add_resource({ 'id': PROJECT_ROOT_ID, 'name': PROJECT_ROOT, 'type': 'resourceGroup', '$path': PROJECT_ROOT, '$parentId': None, '$ancestors': [] })
+		self._add_resource({ 'id': MODEL_SERVER_ID, 'name': 'Stand-in Model Server', 'type': 'modelServer', 'connectionUrls': [server_url] }, listed=False)
+
+	def create_resource_group(self, name, parent_id=None):
+		with self.lock:
+			parent = self.resources.get(parent_id or PROJECT_ROOT_ID)
+			if parent is None:
+				raise StandInError(6, f'Resource "{parent_id}" not found.')
+			return self._create_child(parent, name, 'resourceGroup')['id']
+
+	def create_blob(self, path, content):
+		# Creates missing directories of the path as well, like a committed batch upload does.
+		with self.lock:
+			return self._create_blob(path, content)
+
+	def find(self, criterion, sort_by=None, limit=None):
+		with self.lock:
+			result = [resource for resource in self.resources.values() if resource.get('$listed', True) and matches(resource, criterion)]
+		if limit is None and len(result) > MAX_RESULT_LIMIT:
+			raise StandInError(17, 'Result limit exceeded.')
+		if limit is not None and int(limit) > MAX_RESULT_LIMIT:
+			raise StandInError(17, 'Result limit exceeded.')
+		if sort_by:
+			result.sort(key=lambda resource: get_comparable(resource.get(sort_by), sort_by))
+		if limit is not None:
+			result = result[:int(limit)]
+		return [public_resource(resource) for resource in result]
+
+	def get(self, resource_id):
+		with self.lock:
+			resource = self.resources.get(resource_id)
+		if resource is None:
+			raise StandInError(6, f'Resource "{resource_id}" not found.')
+		return public_resource(resource)
+
+	def delete(self, resource_id):
+		with self.lock:
+			resource = self.resources.get(resource_id)
+			if resource is None:
+				raise StandInError(6, f'Resource "{resource_id}" not found.')
+			self._delete(resource)
+
+	def start_delete_job(self, ids):
+		with self.lock:
+			for resource_id in ids:
+				resource = self.resources.get(resource_id)
+				if resource is not None:
+					self._delete(resource)
+			job = { 'id': str(uuid.uuid4()), 'jobType': 'deleteResources', 'status': 'running', 'progress': { 'min': 0, 'max': len(ids), 'current': 0 }, 'resultCode': None, 'result': None, 'polls': 0 }
+			self.jobs[job['id']] = job
+			return public_job(job)
+
+	def poll_job(self, job_id):
+		with self.lock:
+			job = self.jobs.get(job_id)
+			if job is None:
+				raise StandInError(6, f'Job "{job_id}" not found.')
+			job['polls'] += 1
+			progress = job['progress']
+			progress['current'] = min(progress['max'], progress['max'] * job['polls'] // max(1, self.job_polls))
+			if job['polls'] >= self.job_polls:
+				job['status'] = 'completed'
+				job['resultCode'] = 0
+			return public_job(job)
+
+	def get_changes(self, path, resource_group_id, from_revision):
+		with self.lock:
+			if resource_group_id is not None:
+				directory = self.resources.get(resource_group_id)
+				if directory is None:
+					raise StandInError(6, f'Resource "{resource_group_id}" not found.')
+				path = directory['$path']
+			prefix = (path or PROJECT_ROOT).rstrip('/').lower() + '/'
+			if not from_revision:
+				created = [
+					{ 'id': resource['id'], 'path': resource['$path'], 'revision': resource['revision'], 'timestamp': resource['timestamp'] }
+					for resource in self.resources.values() if resource['type'] == 'blob' and resource['$path'].lower().startswith(prefix)
+				]
+				return { 'endRevision': self.revision, 'created': created, 'updated': [], 'deleted': [] }
+			result = { 'endRevision': self.revision, 'created': [], 'updated': [], 'deleted': [] }
+			for revision, kind, item in self.changes[from_revision:]:
+				if item['path'].lower().startswith(prefix):
+					result[kind].append(item)
+			return result
+
+	def _add_resource(self, resource, listed=True):
+		if not listed:
+			resource['$listed'] = False
+		self.resources[resource['id']] = resource
+		self.children.setdefault(resource.get('$parentId'), {})[resource.get('name', '').lower()] = resource
+		return resource
+
+	def _create_child(self, parent, name, resource_type, **values):
+		existing = self.children.get(parent['id'], {}).get(name.lower())
+		if existing is not None:
+			if existing['type'] != resource_type:
+				raise StandInError(5, f'Resource "{name}" exists.')
+			return existing
+		resource = dict(values,
+			id=str(uuid.uuid4()),
+			name=name,
+			type=resource_type,
+			**{
+				'$path': parent['$path'] + '/' + name,
+				'$parentId': parent['id'],
+				'$ancestors': parent['$ancestors'] + [{ 'id': parent['id'], 'name': parent['name'] }]
+			})
+		return self._add_resource(resource)
+
+	def _create_blob(self, path, content):
+		parent = self.resources[PROJECT_ROOT_ID]
+		parts = [part for part in path.split('/') if part]
+		for part in parts[:-1]:
+			parent = self._create_child(parent, part, 'resourceGroup')
+		existing = self.children.get(parent['id'], {}).get(parts[-1].lower())
+		self.revision += 1
+		timestamp = int(time.time() * 1000)
+		values = { 'modelServerId': MODEL_SERVER_ID, 'size': len(content), 'revision': self.revision, 'timestamp': timestamp, '$size': len(content), '$modifiedDate': timestamp }
+		if existing is not None and existing['type'] == 'blob':
+			existing.update(values)
+			blob = existing
+			kind = 'updated'
+		else:
+			blob = self._create_child(parent, parts[-1], 'blob', **values)
+			kind = 'created'
+		self.contents[blob['id']] = content
+		self.changes.append((self.revision, kind, { 'id': blob['id'], 'path': blob['$path'], 'revision': blob['revision'], 'timestamp': blob['timestamp'] }))
+		return blob
+
+	def _delete(self, resource):
+		for child in list(self.children.get(resource['id'], {}).values()):
+			self._delete(child)
+		self.children.pop(resource['id'], None)
+		self.children.get(resource['$parentId'], {}).pop(resource['name'].lower(), None)
+		del self.resources[resource['id']]
+		if resource['type'] == 'blob':
+			self.contents.pop(resource['id'], None)
+			self.revision += 1
+			self.changes.append((self.revision, 'deleted', { 'id': resource['id'], 'path': resource['$path'] }))
+
+def public_resource(resource):
+	return { key: value for key, value in resource.items() if key != '$listed' }
+
+def public_job(job):
+	return { key: value for key, value in job.items() if key != 'polls' }
+
+def get_comparable(value, key):
+	# Paths are case insensitive.
+	if key == '$path' and isinstance(value, str):
+		return value.lower()
+	return '' if value is None else value
+
+COMPARISONS = {
+	'$eq': lambda a, b: a == b,
+	'$ne': lambda a, b: a != b,
+	'$gt': lambda a, b: a is not None and a > b,
+	'$gte': lambda a, b: a is not None and a >= b,
+	'$lt': lambda a, b: a is not None and a < b,
+	'$lte': lambda a, b: a is not None and a <= b,
+	'$in': lambda a, b: a in b,
+	# % matches any characters, like in SQL.
+	'$like': lambda a, b: isinstance(a, str) and re.fullmatch('.*'.join(re.escape(part) for part in b.split('%')), a, re.DOTALL) is not None
+}
+
+def matches(resource, criterion):
+	# Subset of the Manager criterion language: $and, $or, $not, field comparisons and $like.
+	for operator, argument in criterion.items():
+		if operator == '$and':
+			if not all(matches(resource, item) for item in argument):
+				return False
+		elif operator == '$or':
+			if not any(matches(resource, item) for item in argument):
+				return False
+		elif operator == '$not':
+			if matches(resource, argument):
+				return False
+		elif operator in COMPARISONS:
+			for key, value in argument.items():
+				expected = [get_comparable(item, key) for item in value] if operator == '$in' else get_comparable(value, key)
+				if not COMPARISONS[operator](get_comparable(resource.get(key), key) if key in resource else None, expected):
+					return False
+		else:
+			raise StandInError(7, f'Unknown criterion operator "{operator}".')
+	return True
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# Headers and bodies are written separately, Nagle's algorithm would delay the bodies of small responses.
+	disable_nagle_algorithm = True
+
+	def log_message(self, format, *args):
+		pass
+
+	def do_GET(self):
+		self._handle('GET')
+
+	def do_POST(self):
+		self._handle('POST')
+
+	def do_PUT(self):
+		self._handle('PUT')
+
+	def do_DELETE(self):
+		self._handle('DELETE')
+
+	def _handle(self, method):
+		parsed = urlparse(self.path)
+		self.params = { key: values[0] for key, values in parse_qs(parsed.query, keep_blank_values=True).items() }
+		length = int(self.headers.get('Content-Length') or 0)
+		self.body = self.rfile.read(length) if length else b''
+		route = parsed.path.strip('/')
+		blob_server = not route.startswith('management/')
+		try:
+			handler = ROUTES.get(route)
+			if handler is None:
+				self._send(404, b'Not found.', 'text/plain')
+				return
+			handler(self, self.server.state)
+		except StandInError as err:
+			if err.status_code == 401:
+				self._send_json({ 'error': 'invalid_token', 'error_description': err.message }, 401)
+			elif blob_server:
+				self._send_json({ 'data': { 'error-code': err.code, 'error-message': err.message } }, 430)
+			else:
+				self._send_json({ 'error-code': err.code, 'error-message': err.message }, 430)
+
+	def _json_body(self):
+		return json.loads(self.body.decode('utf-8')) if self.body else None
+
+	def _authorize(self, state):
+		token = (self.headers.get('Authorization') or '')[len('Bearer '):]
+		with state.lock:
+			expires = state.tokens.get(token)
+		if expires is None or expires <= time.time():
+			raise StandInError(None, 'Access token is invalid or expired.', 401)
+
+	def _authorize_session(self, state):
+		with state.lock:
+			if self.params.get('session-id') not in state.sessions:
+				raise StandInError(11, 'Session not found.')
+
+	def _send(self, status_code, content, content_type):
+		self.send_response(status_code)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+
+	def _send_json(self, value, status_code=200):
+		self._send(status_code, json.dumps(value).encode('utf-8'), 'application/json')
+
+	def _send_empty(self):
+		self._send(200, b'', 'application/json')
+
+	# Manager
+
+	def token(self, state):
+		form = { key: values[0] for key, values in parse_qs(self.body.decode('utf-8')).items() }
+		if form.get('grant_type') not in ('password', 'refresh_token', 'authorization_code'):
+			self._send_json({ 'error': 'unsupported_grant_type' }, 400)
+			return
+		access_token = uuid.uuid4().hex
+		expires = time.time() + self.server.token_ttl
+		with state.lock:
+			state.tokens[access_token] = expires
+		self._send_json({
+			'user_id': 'standInUser',
+			'access_token': access_token,
+			'refresh_token': uuid.uuid4().hex,
+			'access_token_exp': expires,
+			'token_type': 'Bearer'
+		})
+
+	def get_resource(self, state):
+		self._authorize(state)
+		self._send_json(state.get(self.params.get('resource-id')))
+
+	def get_resources_by_criterion(self, state):
+		self._authorize(state)
+		self._send_json(state.find(self._json_body() or {}, self.params.get('sort-by'), self.params.get('limit')))
+
+	def insert_resource_group(self, state):
+		self._authorize(state)
+		self._send_json(state.create_resource_group(self._json_body()['name'], self.params.get('parent-id') or None))
+
+	def delete_resource(self, state):
+		self._authorize(state)
+		state.delete(self.params.get('resource-id'))
+		self._send_empty()
+
+	def delete_resources_by_id_list(self, state):
+		self._authorize(state)
+		self._send_json(state.start_delete_job(self._json_body()['ids']))
+
+	def get_job(self, state):
+		self._authorize(state)
+		self._send_json(state.poll_job(self.params.get('job-id')))
+
+	def get_blob_changes_for_sync(self, state):
+		self._authorize(state)
+		request = self._json_body()
+		self._send_json(state.get_changes(request.get('path'), request.get('resourceGroupId'), request.get('fromRevision') or 0))
+
+	def get_inherited_default_blob_server_id(self, state):
+		self._authorize(state)
+		self._send_json(MODEL_SERVER_ID)
+
+	def get_ticket(self, state):
+		self._authorize(state)
+		self._send(200, base64.b64encode(uuid.uuid4().bytes), 'text/plain')
+
+	def get_user(self, state):
+		self._authorize(state)
+		self._send_json({ 'id': self.params.get('user-id'), 'username': 'stand-in', 'name': 'Stand-in User' })
+
+	# Blob Server
+
+	def get_runtime_id(self, state):
+		self._send_json(self.server.runtime_id)
+
+	def create_session(self, state):
+		session_id = uuid.uuid4().hex
+		with state.lock:
+			state.sessions.add(session_id)
+		self._send_json({ 'data': { 'id': session_id } })
+
+	def close_session(self, state):
+		with state.lock:
+			state.sessions.discard(self.params.get('session-id'))
+		self._send_empty()
+
+	def begin_batch_upload(self, state):
+		self._authorize_session(state)
+		batch_id = uuid.uuid4().hex
+		with state.lock:
+			state.batches[batch_id] = []
+		self._send_json({ 'data': { 'id': batch_id, 'namespace-name': batch_id } })
+
+	def begin_upload(self, state):
+		self._authorize_session(state)
+		upload_id = uuid.uuid4().hex
+		with state.lock:
+			if self.params.get('namespace-name') not in state.batches:
+				raise StandInError(17, 'Blob namespace not found.')
+			state.uploads[upload_id] = { 'batch': self.params['namespace-name'], 'path': self.params['blob-name'], 'parts': {}, 'committed': False }
+		self._send_json({ 'data': { 'id': upload_id } })
+
+	def put_blob_content_part(self, state):
+		self._authorize_session(state)
+		offset = int(self.params.get('offset') or 0)
+		if int(self.params.get('length') or 0) != len(self.body):
+			raise StandInError(13, 'Invalid blob content part.')
+		with state.lock:
+			upload = state.uploads.get(self.params.get('upload-session-id'))
+			if upload is None or upload['committed']:
+				raise StandInError(14, 'Upload session not found.')
+			upload['parts'][offset] = self.body
+		self._send_json({ 'data': { 'offset': offset, 'length': len(self.body) } })
+
+	def commit_upload(self, state):
+		self._authorize_session(state)
+		with state.lock:
+			upload_id = self.params.get('upload-session-id')
+			upload = state.uploads.get(upload_id)
+			if upload is None or upload['committed']:
+				raise StandInError(14, 'Upload session not found.')
+			content = bytearray()
+			for offset in sorted(upload['parts']):
+				if offset != len(content):
+					raise StandInError(15, 'Incomplete upload.')
+				content += upload['parts'][offset]
+			upload['committed'] = True
+			upload['content'] = bytes(content)
+			del upload['parts']
+			state.batches[upload['batch']].append(upload_id)
+		self._send_json({ 'data': { 'id': upload_id, 'size': len(content) } })
+
+	def commit_batch_upload(self, state):
+		self._authorize_session(state)
+		with state.lock:
+			upload_ids = state.batches.pop(self.params.get('batch-upload-session-id'), None)
+			if upload_ids is None:
+				raise StandInError(12, 'Batch upload commit failed.')
+			result = []
+			for upload_id in upload_ids:
+				upload = state.uploads.pop(upload_id)
+				blob = state._create_blob(upload['path'], upload['content'])
+				result.append({
+					'standard-metadata': {
+						'blob-id': blob['id'],
+						'blob-name': upload['path'],
+						'content-revision': str(blob['revision']),
+						'last-modified': str(blob['timestamp']),
+						'content-hash-algorithm': 'SHA256',
+						'content-hash': base64.urlsafe_b64encode(hashlib.sha256(upload['content']).digest()).rstrip(b'=').decode('ascii'),
+						'size': str(blob['size'])
+					}
+				})
+		self._send_json({ 'data-content-type': 'application/vnd.graphisoft.teamwork.blob-store-service-1.0.blob-metadata-1.0-list+json', 'data': result })
+
+	def get_blob_content(self, state):
+		self._authorize_session(state)
+		with state.lock:
+			content = state.contents.get(self.params.get('blob-id'))
+		if content is None:
+			raise StandInError(21, 'Blob not found.')
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/octet-stream')
+		self.send_header('Content-Length', str(len(content)))
+		self.end_headers()
+		view = memoryview(content)
+		for offset in range(0, len(content), CONTENT_BUFFER_SIZE):
+			self.wfile.write(view[offset:offset + CONTENT_BUFFER_SIZE])
+
+ROUTES = {
+	'management/client/oauth2/token': StandInRequestHandler.token,
+	'management/client/get-resource': StandInRequestHandler.get_resource,
+	'management/client/get-resources-by-criterion': StandInRequestHandler.get_resources_by_criterion,
+	'management/client/insert-resource-group': StandInRequestHandler.insert_resource_group,
+	'management/client/delete-resource-group': StandInRequestHandler.delete_resource,
+	'management/client/delete-blob': StandInRequestHandler.delete_resource,
+	'management/client/delete-resources-by-id-list': StandInRequestHandler.delete_resources_by_id_list,
+	'management/client/get-job': StandInRequestHandler.get_job,
+	'management/client/get-blob-changes-for-sync': StandInRequestHandler.get_blob_changes_for_sync,
+	'management/client/get-inherited-default-blob-server-id': StandInRequestHandler.get_inherited_default_blob_server_id,
+	'management/client/ticket-generator/get-ticket': StandInRequestHandler.get_ticket,
+	'management/client/get-user': StandInRequestHandler.get_user,
+	'application-server-service/get-runtime-id': StandInRequestHandler.get_runtime_id,
+	'session-service/1.0/create-session': StandInRequestHandler.create_session,
+	'session-service/1.0/close-session': StandInRequestHandler.close_session,
+	'blob-store-service/1.0/begin-batch-upload': StandInRequestHandler.begin_batch_upload,
+	'blob-store-service/1.0/begin-upload': StandInRequestHandler.begin_upload,
+	'blob-store-service/1.0/put-blob-content-part': StandInRequestHandler.put_blob_content_part,
+	'blob-store-service/1.0/commit-upload': StandInRequestHandler.commit_upload,
+	'blob-store-service/1.0/commit-batch-upload': StandInRequestHandler.commit_batch_upload,
+	'blob-store-service/1.0/get-blob-content': StandInRequestHandler.get_blob_content
+}
+
+class StandInServer(ThreadingHTTPServer):
+	# Local, in-process stand-in of a BIMcloud Manager and its Model (Blob) Server on one port,
+	# implementing the endpoints the API classes use. It runs on a background thread.
+	daemon_threads = True
+
+	def __init__(self, host='127.0.0.1', port=0, token_ttl=3600, job_polls=3):
+		super().__init__((host, port), StandInRequestHandler)
+		self.url = f'http://{host}:{self.server_address[1]}'
+		self.token_ttl = token_ttl
+		self.runtime_id = uuid.uuid4().hex
+		self.state = StandInState(self.url, job_polls)
+		self._thread = None
+
+	def start(self):
+		self._thread = threading.Thread(target=self.serve_forever, name='bimcloud-stand-in', daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+		if self._thread is not None:
+			self._thread.join()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
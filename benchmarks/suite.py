@@ -0,0 +1,164 @@
+import os
+import platform
+import statistics
+import tempfile
+import time
+from lib.managerapi import ManagerApi
+from lib.blobserverapi import BlobServerApi
+from lib.chunksizer import AdaptiveChunkSizer
+from lib.treewalker import TreeWalker
+from .standin import MODEL_SERVER_ID
+
+SCENARIOS = ('metadata', 'upload', 'download', 'tree_listing', 'changefeed')
+
+def percentiles(samples):
+	# Latencies in milliseconds.
+	ordered = sorted(samples)
+	def at(ratio):
+		return ordered[min(len(ordered) - 1, int(round(ratio * (len(ordered) - 1))))] * 1000
+	return {
+		'count': len(ordered),
+		'min': ordered[0] * 1000,
+		'mean': statistics.mean(ordered) * 1000,
+		'p50': at(0.5),
+		'p90': at(0.9),
+		'p99': at(0.99),
+		'max': ordered[-1] * 1000
+	}
+
+def timed(fn):
+	start = time.perf_counter()
+	result = fn()
+	return time.perf_counter() - start, result
+
+class BenchmarkOptions:
+	def __init__(self, metadata_calls=500, blob_size=16 * 1024 * 1024, chunk_size=1024 * 1024, adaptive_chunk_size=False, upload_workers=4, transfer_repeat=5, tree_dirs=20, tree_blobs_per_dir=50, changefeed_blobs=2000, changefeed_polls=50):
+		self.metadata_calls = metadata_calls
+		self.blob_size = blob_size
+		self.chunk_size = chunk_size
+		# Uploads tune their chunk size from scratch (chunk_size is ignored), so every upload starts from the same state.
+		self.adaptive_chunk_size = adaptive_chunk_size
+		self.upload_workers = upload_workers
+		self.transfer_repeat = transfer_repeat
+		self.tree_dirs = tree_dirs
+		self.tree_blobs_per_dir = tree_blobs_per_dir
+		self.changefeed_blobs = changefeed_blobs
+		self.changefeed_polls = changefeed_polls
+
+class BenchmarkSuite:
+	# Measures the client against a StandInServer. Fixtures (trees, changes) are put into the server state directly,
+	# so only the measured calls go through the API classes.
+	def __init__(self, server, options=None):
+		self._server = server
+		self._options = options if options is not None else BenchmarkOptions()
+		self._manager_api = ManagerApi(server.url, safe=False)
+		# Not the process-wide chunk sizer, learned sizes would carry over between runs.
+		self._blob_server_api = BlobServerApi(server.url, chunk_sizer=AdaptiveChunkSizer())
+		self._auth_context = self._manager_api.get_token_by_password_grant('benchmark', 'benchmark', 'benchmark')
+		ticket = self._manager_api.get_ticket(self._auth_context, MODEL_SERVER_ID)
+		self._session_id = self._blob_server_api.create_session('benchmark', ticket)
+
+	def close(self):
+		self._blob_server_api.close_session(self._session_id)
+		self._blob_server_api.close()
+		self._manager_api.close()
+
+	def run(self, scenarios=SCENARIOS):
+		results = {}
+		for name in scenarios:
+			results[name] = getattr(self, 'bench_' + name)()
+		return {
+			'environment': {
+				'python': platform.python_version(),
+				'platform': platform.platform(),
+				'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+			},
+			'options': vars(self._options),
+			'results': results
+		}
+
+	def bench_metadata(self):
+		# Small request/response round trips: get-resource by id.
+		directory_id = self._manager_api.create_resource_group(self._auth_context, 'metadata')
+		latencies = [timed(lambda: self._manager_api.get_resource_by_id(self._auth_context, directory_id))[0] for _ in range(self._options.metadata_calls)]
+		return {
+			'latency': percentiles(latencies),
+			'ops_per_second': len(latencies) / sum(latencies)
+		}
+
+	def bench_upload(self):
+		options = self._options
+		content = os.urandom(options.blob_size)
+		api = self._blob_server_api
+		def upload(index):
+			if options.adaptive_chunk_size:
+				api.chunk_sizer = AdaptiveChunkSizer()
+			batch = api.begin_batch_upload(self._session_id, 'benchmark')
+			api.upload_blob(self._session_id, f'/upload/blob{index}', batch['namespace-name'], content, None if options.adaptive_chunk_size else options.chunk_size, options.upload_workers)
+			return api.commit_batch_upload(self._session_id, batch['id'])
+		latencies = [timed(lambda: upload(index))[0] for index in range(options.transfer_repeat)]
+		return {
+			'latency': percentiles(latencies),
+			'megabytes_per_second': options.blob_size * len(latencies) / sum(latencies) / (1024 * 1024)
+		}
+
+	def bench_download(self):
+		options = self._options
+		blob = self._server.state.create_blob('/download/blob', os.urandom(options.blob_size))
+		with tempfile.TemporaryDirectory() as local_dir:
+			target = os.path.join(local_dir, 'blob')
+			latencies = [timed(lambda: self._blob_server_api.download_blob_to(self._session_id, blob['id'], target))[0] for _ in range(options.transfer_repeat)]
+		return {
+			'latency': percentiles(latencies),
+			'megabytes_per_second': options.blob_size * len(latencies) / sum(latencies) / (1024 * 1024)
+		}
+
+	def bench_tree_listing(self):
+		options = self._options
+		state = self._server.state
+		for dir_index in range(options.tree_dirs):
+			for blob_index in range(options.tree_blobs_per_dir):
+				state.create_blob(f'/tree/dir{dir_index}/blob{blob_index}', b'')
+		root = self._manager_api.get_resource(self._auth_context, 'Project Root/tree')
+		walker = TreeWalker(self._manager_api, self._auth_context)
+		elapsed, resources = timed(lambda: list(walker.walk(root)))
+		return {
+			'seconds': elapsed,
+			'resources': len(resources),
+			'resources_per_second': len(resources) / elapsed
+		}
+
+	def bench_changefeed(self):
+		# Snapshot polls (from revision 0) and incremental polls after a single change each.
+		options = self._options
+		state = self._server.state
+		for index in range(options.changefeed_blobs):
+			state.create_blob(f'/changefeed/blob{index}', b'')
+		path = 'Project Root/changefeed'
+		poll = lambda revision: self._manager_api.get_blob_changes_for_sync(self._auth_context, path, None, revision)
+
+		snapshot_latencies = [timed(lambda: poll(0))[0] for _ in range(max(1, options.changefeed_polls // 10))]
+		revision = poll(0)['endRevision']
+		incremental_latencies = []
+		for index in range(options.changefeed_polls):
+			state.create_blob(f'/changefeed/new{index}', b'')
+			elapsed, changes = timed(lambda: poll(revision))
+			revision = changes['endRevision']
+			incremental_latencies.append(elapsed)
+		return {
+			'snapshot_latency': percentiles(snapshot_latencies),
+			'incremental_latency': percentiles(incremental_latencies)
+		}
+
+def compare(baseline, current):
+	# Relative change of every numeric metric, eg. { 'upload.latency.p50': 0.12 } is 12% more than the baseline.
+	result = {}
+	def walk(prefix, base, value):
+		if isinstance(value, dict):
+			for key in value:
+				if isinstance(base, dict) and key in base:
+					walk(f'{prefix}.{key}' if prefix else key, base[key], value[key])
+		elif isinstance(value, (int, float)) and isinstance(base, (int, float)) and not isinstance(value, bool) and base:
+			result[prefix] = (value - base) / base
+	walk('', baseline.get('results', {}), current.get('results', {}))
+	return result
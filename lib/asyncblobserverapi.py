@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import aiohttp
+from .url import is_url, join_url
+from .httpsession import HttpSessionOptions
+from .asynchttp import BufferedResponse, create_async_http_session, drop_none_params
+from .blobserverapi import BlobServerApi, DEFAULT_CHUNK_SIZE
+from .blobsource import BlobSource
+
+class AsyncBlobContent:
+	# Streamed get-blob-content response, the body is read only as the caller iterates it.
+	def __init__(self, response):
+		self._response = response
+		self.headers = response.headers
+
+	async def iter_content(self, chunk_size=1024 * 1024):
+		async for chunk in self._response.content.iter_chunked(chunk_size):
+			yield chunk
+
+	def close(self):
+		self._response.release()
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+class AsyncBlobServerApi:
+	def __init__(self, server_url, http_options=None, session=None):
+		if not is_url(server_url):
+			raise ValueError('Server url is invalid.')
+
+		self.server_url = server_url
+		self._http_options = http_options if http_options is not None else HttpSessionOptions()
+		self._session = session
+
+	async def close(self):
+		if self._session is not None:
+			await self._session.close()
+			self._session = None
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		await self.close()
+
+	async def create_session(self, username, ticket):
+		request = {
+			'data-content-type': 'application/vnd.graphisoft.teamwork.session-service-1.0.authentication-request-1.0+json',
+			'data': {
+				'username': username,
+				'ticket': ticket
+			}
+		}
+		url = join_url(self.server_url, 'session-service/1.0/create-session')
+		response = await self._request('POST', url, json=request, headers={ 'content-type': request['data-content-type'] })
+		result = self.process_response(response)
+		return result['data']['id']
+
+	async def close_session(self, session_id):
+		url = join_url(self.server_url, 'session-service/1.0/close-session')
+		response = await self._request('POST', url, params={ 'session-id': session_id })
+		self.process_response(response)
+
+	async def begin_batch_upload(self, session_id, description):
+		url = join_url(self.server_url, '/blob-store-service/1.0/begin-batch-upload')
+		response = await self._request('POST', url,
+			params={
+				'session-id': session_id,
+				'description': description
+			})
+		result = self.process_response(response)
+		return result['data']
+
+	async def commit_batch_upload(self, session_id, batch_id, conflict_behavior='overwrite'):
+		url = join_url(self.server_url, '/blob-store-service/1.0/commit-batch-upload')
+		response = await self._request('POST', url,
+			params={
+				'session-id': session_id,
+				'batch-upload-session-id': batch_id,
+				'conflict-behavior': conflict_behavior
+			})
+		result = self.process_response(response)
+		return result['data']
+
+	async def begin_upload(self, session_id, path, namespace_name):
+		url = join_url(self.server_url, '/blob-store-service/1.0/begin-upload')
+		response = await self._request('POST', url,
+			params={
+				'session-id': session_id,
+				'blob-name': path,
+				'namespace-name': namespace_name
+			})
+		result = self.process_response(response)
+		return result['data']
+
+	async def commit_upload(self, session_id, upload_id):
+		url = join_url(self.server_url, '/blob-store-service/1.0/commit-upload')
+		response = await self._request('POST', url,
+			params={
+				'session-id': session_id,
+				'upload-session-id': upload_id
+			})
+		result = self.process_response(response)
+		return result['data']
+
+	async def put_blob_content_part(self, session_id, upload_id, data, offset=None):
+		url = join_url(self.server_url, '/blob-store-service/1.0/put-blob-content-part')
+		response = await self._request('POST', url,
+			params={
+				'session-id': session_id,
+				'upload-session-id': upload_id,
+				'offset': offset if offset else 0,
+				'length': len(data)
+			},
+			data=data)
+		result = self.process_response(response)
+		return result['data']
+
+	async def upload_blob(self, session_id, path, namespace_name, source, chunk_size=DEFAULT_CHUNK_SIZE, max_workers=4, max_part_attempts=3):
+		upload = await self.begin_upload(session_id, path, namespace_name)
+		await self.upload_blob_content(session_id, upload['id'], source, chunk_size, max_workers, max_part_attempts)
+		return await self.commit_upload(session_id, upload['id'])
+
+	async def upload_blob_content(self, session_id, upload_id, source, chunk_size=DEFAULT_CHUNK_SIZE, max_workers=4, max_part_attempts=3):
+		own_source = not isinstance(source, BlobSource)
+		if own_source:
+			source = BlobSource(source)
+		try:
+			pending = collections.deque()
+			if source.size:
+				pending.append((0, source.size))
+			failures = collections.Counter()
+			in_flight = {}
+			try:
+				while pending or in_flight:
+					while pending and len(in_flight) < max_workers:
+						offset, length = pending.popleft()
+						part_length = min(length, chunk_size)
+						if part_length < length:
+							pending.appendleft((offset + part_length, length - part_length))
+						delay = BlobServerApi.get_part_retry_delay(failures[offset])
+						task = asyncio.ensure_future(self._put_source_part(session_id, upload_id, source, offset, part_length, delay))
+						in_flight[task] = (offset, part_length)
+
+					done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+					for task in done:
+						offset, part_length = in_flight.pop(task)
+						err = task.exception()
+						if err is None:
+							continue
+						failures[offset] += 1
+						if failures[offset] >= max_part_attempts or not AsyncBlobServerApi.is_retryable_part_error(err):
+							raise err
+						pending.append((offset, part_length))
+			finally:
+				for task in in_flight:
+					task.cancel()
+				if in_flight:
+					await asyncio.wait(in_flight)
+		finally:
+			if own_source:
+				source.close()
+
+	async def _put_source_part(self, session_id, upload_id, source, offset, length, delay):
+		if delay:
+			await asyncio.sleep(delay)
+		if source.path is None:
+			data = source.read(offset, length)
+		else:
+			data = await asyncio.get_running_loop().run_in_executor(None, source.read, offset, length)
+		return await self.put_blob_content_part(session_id, upload_id, data, offset=offset)
+
+	async def get_blob_content(self, session_id, blob_id):
+		url = join_url(self.server_url, '/blob-store-service/1.0/get-blob-content')
+		response = await self._send('GET', url,
+			params={
+				'session-id': session_id,
+				'blob-id': blob_id
+			})
+		if response.status >= 400:
+			try:
+				self.process_response(await BufferedResponse.read(response), json=False)
+			finally:
+				response.release()
+		return AsyncBlobContent(response)
+
+	async def _send(self, method, url, params=None, **kwargs):
+		if self._session is None:
+			self._session = create_async_http_session(self._http_options)
+		return await self._session.request(method, url, params=drop_none_params(params), **kwargs)
+
+	async def _request(self, method, url, params=None, **kwargs):
+		response = await self._send(method, url, params, **kwargs)
+		try:
+			return await BufferedResponse.read(response)
+		finally:
+			response.release()
+
+	@staticmethod
+	def is_retryable_part_error(err):
+		if isinstance(err, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+			return True
+		return BlobServerApi.is_retryable_part_error(err)
+
+	@staticmethod
+	def process_response(response, json=True):
+		return BlobServerApi.process_response(response, json=json)
@@ -0,0 +1,45 @@
+import json
+import aiohttp
+from .httpsession import HttpSessionOptions
+
+class BufferedResponse:
+	# Mimics the parts of requests.Response that process_response and HttpError rely on,
+	# so the sync and async clients map errors the very same way.
+	def __init__(self, status_code, reason, headers, content):
+		self.status_code = status_code
+		self.reason = reason
+		self.headers = headers
+		self.content = content
+
+	@property
+	def ok(self):
+		return self.status_code < 400
+
+	@property
+	def text(self):
+		return self.content.decode('utf-8', errors='replace') if self.content else ''
+
+	def json(self):
+		return json.loads(self.content)
+
+	@staticmethod
+	async def read(response):
+		content = await response.read()
+		return BufferedResponse(response.status, response.reason, response.headers, content)
+
+def create_async_http_session(options=None):
+	if options is None:
+		options = HttpSessionOptions()
+
+	connector = aiohttp.TCPConnector(
+		limit=options.pool_connections * options.pool_maxsize,
+		limit_per_host=options.pool_maxsize,
+		force_close=not options.keep_alive)
+	timeout = aiohttp.ClientTimeout(sock_connect=options.connect_timeout, sock_read=options.read_timeout)
+	return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+def drop_none_params(params):
+	# requests silently skips None query parameters, aiohttp refuses them.
+	if params is None:
+		return None
+	return { key: value for key, value in params.items() if value is not None }
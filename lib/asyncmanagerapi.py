@@ -0,0 +1,222 @@
+import asyncio
+import time
+import webbrowser
+from .errors import HttpError
+from .url import is_url, join_url, add_params
+from .httpsession import HttpSessionOptions
+from .asynchttp import BufferedResponse, create_async_http_session, drop_none_params
+from .managerapi import ManagerApi, ManagerApiRequestContext, DEFAULT_REFRESH_MARGIN
+
+class AsyncManagerApi:
+	def __init__(self, manager_url, safe=True, http_options=None, session=None, refresh_margin=DEFAULT_REFRESH_MARGIN):
+		if not is_url(manager_url):
+			raise ValueError('Manager url is invalid.')
+
+		self.manager_url = manager_url
+		self._api_root = join_url(manager_url, 'management/client')
+		self._safe = safe
+		self._http_options = http_options if http_options is not None else HttpSessionOptions()
+		self._session = session
+		self._refresh_margin = refresh_margin
+
+	async def close(self):
+		if self._session is not None:
+			await self._session.close()
+			self._session = None
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		await self.close()
+
+	def open_authorization_page(self, client_id, state):
+		url = add_params(join_url(self._api_root, 'oauth2', 'authorize'), { 'client_id': client_id, 'state': state })
+		webbrowser.open(url, new=0, autoraise=0)
+
+	async def get_authorization_code_by_state(self, state):
+		url = join_url(self._api_root, 'oauth2', 'get-authorization-code-by-state')
+		response = await self._request('GET', url, params={ 'state': str(state) })
+		result = self.process_response(response)
+		return result['status'], result['code']
+
+	async def get_token_by_password_grant(self, username, password, client_id):
+		request = {
+			'grant_type': 'password',
+			'username': username,
+			'password': password,
+			'client_id': client_id
+		}
+		return await self._get_token(request, client_id)
+
+	async def get_token_by_refresh_token_grant(self, refresh_token, client_id):
+		request = {
+			'grant_type': 'refresh_token',
+			'refresh_token': refresh_token,
+			'client_id': client_id
+		}
+		return await self._get_token(request, client_id)
+
+	async def get_token_by_authorization_code_grant(self, authorization_code, client_id):
+		request = {
+			'grant_type': 'authorization_code',
+			'code': authorization_code,
+			'client_id': client_id
+		}
+		return await self._get_token(request, client_id)
+
+	async def _get_token(self, request, client_id):
+		url = join_url(self._api_root, 'oauth2', 'token')
+		response = await self._request('POST', url, data=request, headers={ 'Content-Type': 'application/x-www-form-urlencoded' })
+		result = self.process_response(response)
+		return ManagerApiRequestContext(result['user_id'], result['access_token'], result['refresh_token'], result['access_token_exp'], result['token_type'], client_id)
+
+	async def get_resource(self, auth_context, by_path=None, by_id=None, try_get=False):
+		if by_id is not None:
+			return await self.get_resource_by_id(auth_context, by_id)
+
+		criterion = None
+		if by_path is not None:
+			criterion = { '$eq': { '$path': by_path } }
+
+		try:
+			return await self.get_resource_by_criterion(auth_context, criterion)
+		except Exception as err:
+			if try_get:
+				return None
+			raise err
+
+	async def get_resource_by_id(self, auth_context, resource_id):
+		if resource_id is None:
+			raise ValueError('"resource_id"" expected.')
+
+		url = join_url(self._api_root, 'get-resource')
+		return await self.refresh_on_expiration('GET', auth_context, url, params={ 'resource-id': resource_id })
+
+	async def get_resources_by_criterion(self, auth_context, criterion, options=None):
+		if criterion is None:
+			raise ValueError('"criterion"" expected.')
+
+		url = join_url(self._api_root, 'get-resources-by-criterion')
+		params = {}
+		if isinstance(options, dict):
+			for key in options:
+				params[key] = options[key]
+
+		result = await self.refresh_on_expiration('POST', auth_context, url, params=params, json=criterion)
+		assert isinstance(result, list), 'Result is not a list.'
+		return result
+
+	async def get_resource_by_criterion(self, auth_context, criterion, options=None):
+		result = await self.get_resources_by_criterion(auth_context, criterion, options)
+		return result[0] if result else None
+
+	async def create_resource_group(self, auth_context, name, parent_id=None):
+		url = join_url(self._api_root, 'insert-resource-group')
+		directory = {
+			'name': name,
+			'type': 'resourceGroup'
+		}
+		result = await self.refresh_on_expiration('POST', auth_context, url, params={ 'parent-id': parent_id }, json=directory)
+		assert isinstance(result, str), 'Result is not a string.'
+		return result
+
+	async def delete_resource_group(self, auth_context, directory_id):
+		url = join_url(self._api_root, 'delete-resource-group')
+		return await self.refresh_on_expiration('DELETE', auth_context, url, params={ 'resource-id': directory_id })
+
+	async def delete_resources_by_id_list(self, auth_context, ids):
+		url = join_url(self._api_root, 'delete-resources-by-id-list')
+		return await self.refresh_on_expiration('POST', auth_context, url, json={ 'ids': ids })
+
+	async def delete_blob(self, auth_context, blob_id):
+		url = join_url(self._api_root, 'delete-blob')
+		await self.refresh_on_expiration('DELETE', auth_context, url, params={'resource-id': blob_id })
+
+	async def update_blob(self, auth_context, blob):
+		url = join_url(self._api_root, 'update-blob')
+		await self.refresh_on_expiration('PUT', auth_context, url, json=blob)
+
+	async def update_blob_parent(self, auth_context, blob_id, body):
+		url = join_url(self._api_root, 'update-blob-parent')
+		await self.refresh_on_expiration('POST', auth_context, url, params={ 'blob-id': blob_id }, json=body)
+
+	async def get_blob_changes_for_sync(self, auth_context, path, resource_group_id, from_revision):
+		url = join_url(self._api_root, 'get-blob-changes-for-sync')
+		request = {
+			'path': path,
+			'resourceGroupId': resource_group_id,
+			'fromRevision': from_revision
+		}
+		return await self.refresh_on_expiration('POST', auth_context, url, json=request)
+
+	async def get_inherited_default_blob_server_id(self, auth_context, resource_group_id):
+		url = join_url(self._api_root, 'get-inherited-default-blob-server-id')
+		return await self.refresh_on_expiration('GET', auth_context, url, params={ 'resource-group-id': resource_group_id })
+
+	async def get_job(self, auth_context, job_id):
+		url = join_url(self._api_root, 'get-job')
+		return await self.refresh_on_expiration('GET', auth_context, url, params={ 'job-id': job_id })
+
+	async def abort_job(self, auth_context, job_id):
+		url = join_url(self._api_root, 'abort-job')
+		return await self.refresh_on_expiration('POST', auth_context, url, params={ 'job-id': job_id })
+
+	async def get_ticket(self, auth_context, resource_id):
+		url = join_url(self._api_root, 'ticket-generator/get-ticket')
+		request = {
+			'type': 'freeTicket',
+			'resources': [resource_id],
+			'format': 'base64'
+		}
+		result = await self.refresh_on_expiration('POST', auth_context, url, False, json=request)
+		assert isinstance(result, bytes), 'Result is not a bytes.'
+		result = result.decode('utf-8')
+		return result
+
+	async def get_user(self, auth_context, user_id):
+		url = join_url(self._api_root, 'get-user')
+		return await self.refresh_on_expiration('GET', auth_context, url, params={ 'user-id': user_id })
+
+	async def refresh_token(self, auth_context, stale_access_token=None):
+		# Single-flight, like ManagerApi.refresh_token, but tasks wait on an asyncio lock.
+		if auth_context._async_refresh_lock is None:
+			auth_context._async_refresh_lock = asyncio.Lock()
+		async with auth_context._async_refresh_lock:
+			if stale_access_token is not None and auth_context._access_token != stale_access_token:
+				return
+			start = time.perf_counter()
+			result = await self.get_token_by_refresh_token_grant(auth_context._refresh_token, auth_context.client_id)
+			auth_context.update_tokens(result, time.perf_counter() - start)
+
+	async def refresh_on_expiration(self, method, auth_context, url, responseJson=True, **kwargs):
+		access_token = auth_context._access_token
+		if auth_context.should_refresh(self._refresh_margin):
+			try:
+				await self.refresh_token(auth_context, access_token)
+			except Exception:
+				# See ManagerApi.refresh_on_expiration.
+				if auth_context.expires_within(0):
+					raise
+			access_token = auth_context._access_token
+		try:
+			response = await self._request(method, url, **kwargs, headers={ 'Authorization': f'Bearer {access_token}' })
+			return self.process_response(response, json=responseJson)
+		except HttpError as e:
+			if e.status_code == 401:
+				errorJson = e.response.json()
+				if 'error' in errorJson and errorJson['error'] == 'invalid_token':
+					await self.refresh_token(auth_context, access_token)
+					response = await self._request(method, url, headers={ 'Authorization': f'Bearer {auth_context._access_token}' }, **kwargs)
+					return self.process_response(response, json=responseJson)
+			raise e
+
+	async def _request(self, method, url, params=None, **kwargs):
+		if self._session is None:
+			self._session = create_async_http_session(self._http_options)
+		async with self._session.request(method, url, params=drop_none_params(params), ssl=self._safe, **kwargs) as response:
+			return await BufferedResponse.read(response)
+
+	@staticmethod
+	def process_response(response, json=True):
+		return ManagerApi.process_response(response, json=json)
@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+class BatchUploader:
+	# Uploads many blobs through shared batch upload sessions.
+	# Entries are grouped into batches by count or by byte budget, members of a batch
+	# get uploaded concurrently, and every batch is committed once.
+	def __init__(self, blob_server_api, session_id, description='', max_batch_count=500, max_batch_bytes=1024 * 1024 * 1024, conflict_behavior='overwrite', max_workers=8, chunk_size=None, part_workers=1):
+		if conflict_behavior not in ('overwrite', 'fail'):
+			raise ValueError('"conflict_behavior" should be "overwrite" or "fail".')
+
+		self._blob_server_api = blob_server_api
+		self._session_id = session_id
+		self._description = description
+		self._max_batch_count = max_batch_count
+		self._max_batch_bytes = max_batch_bytes
+		self._conflict_behavior = conflict_behavior
+		self._chunk_size = chunk_size
+		self._part_workers = part_workers
+		self._executor = ThreadPoolExecutor(max_workers=max_workers)
+		self._entries = []
+		self._entries_size = 0
+		# Blob metadata of every committed upload, as returned by commit_batch_upload.
+		self.committed = []
+
+	def add(self, path, source):
+		size = os.path.getsize(source) if isinstance(source, (str, os.PathLike)) else len(source)
+		if self._entries and (len(self._entries) >= self._max_batch_count or self._entries_size + size > self._max_batch_bytes):
+			self.flush()
+		self._entries.append((path, source))
+		self._entries_size += size
+
+	def flush(self):
+		if not self._entries:
+			return
+
+		api = self._blob_server_api
+		batch = api.begin_batch_upload(self._session_id, self._description)
+		futures = [
+			self._executor.submit(api.upload_blob, self._session_id, path, batch['namespace-name'], source, self._chunk_size, self._part_workers)
+			for path, source in self._entries
+		]
+		# On failure the batch stays uncommitted and its entries pending, so a next flush can start it over.
+		for future in futures:
+			future.result()
+
+		result = api.commit_batch_upload(self._session_id, batch['id'], self._conflict_behavior)
+		self.committed.extend(result)
+		self._entries = []
+		self._entries_size = 0
+
+	def close(self):
+		try:
+			self.flush()
+		finally:
+			self._executor.shutdown()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self._executor.shutdown()
@@ -1,13 +1,72 @@
+import collections
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import requests
-from .errors import raise_bimcloud_blob_server_error, BIMcloudBlobServerError, HttpError
+from .errors import raise_bimcloud_blob_server_error, BIMcloudBlobServerError, HttpError, ContentHashError
 from .url import is_url, join_url
+from .httpsession import HttpSessionOptions
+from .transport import create_transport
+from .blobsource import BlobSource
+from .chunksizer import DEFAULT_CHUNK_SIZER
+from .contenthash import DEFAULT_CONTENT_HASH_ALGORITHM, create_hasher, encode_digest, content_hash_matches
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024 * 4
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+
+def get_umask():
+	# The umask can only be read by setting it, so it's read once at import, before threads could create files.
+	umask = os.umask(0)
+	os.umask(umask)
+	return umask
+
+UMASK = get_umask()
+
+class BlobContent(io.RawIOBase):
+	# Streamed get-blob-content response as a read-only file. The body is read only as the caller reads it,
+	# readinto() fills the caller's buffer, so memory use doesn't depend on the blob size.
+	def __init__(self, response):
+		super().__init__()
+		self.response = response
+		self.headers = response.headers
+		length = response.headers.get('Content-Length')
+		self.size = int(length) if length else None
+		# requests leaves decoding to the reader, compressed content can't be read into a buffer directly.
+		self._decode = response.headers.get('Content-Encoding', 'identity').lower() not in ('', 'identity')
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		if not self._decode:
+			return self.response.raw.readinto(buffer)
+		data = self.response.raw.read(len(buffer), decode_content=True)
+		memoryview(buffer).cast('B')[:len(data)] = data
+		return len(data)
+
+	def iter_content(self, chunk_size=DOWNLOAD_BUFFER_SIZE):
+		return self.response.iter_content(chunk_size=chunk_size)
+
+	def close(self):
+		if not self.closed:
+			self.response.close()
+		super().close()
 
 class BlobServerApi:
-	def __init__(self, server_url):
+	def __init__(self, server_url, http_options=None, session=None, chunk_sizer=None):
 		if not is_url(server_url):
 			raise ValueError('Server url is invalid.')
 
 		self.server_url = server_url
+		self._http_options = http_options if http_options is not None else HttpSessionOptions()
+		self._transport = create_transport(self._http_options, session)
+		# Uploads without an explicit chunk size use the learned size of this server (see AdaptiveChunkSizer).
+		self.chunk_sizer = chunk_sizer if chunk_sizer is not None else DEFAULT_CHUNK_SIZER
+
+	def close(self):
+		self._transport.close()
 
 	def create_session(self, username, ticket):
 		request = {
@@ -18,85 +77,281 @@ class BlobServerApi:
 			}
 		}
 		url = join_url(self.server_url, 'session-service/1.0/create-session')
-		response = requests.post(url, json=request, headers={ 'content-type': request['data-content-type'] })
+		response = self._transport.post(url, json=request, headers={ 'content-type': request['data-content-type'] }, timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return result['data']['id']
 
 	def close_session(self, session_id):
 		url = join_url(self.server_url, 'session-service/1.0/close-session')
-		response = requests.post(url, params={ 'session-id': session_id })
+		response = self._transport.post(url, params={ 'session-id': session_id }, timeout=self._http_options.timeout)
 		self.process_response(response)
 
 	def begin_batch_upload(self, session_id, description):
 		url = join_url(self.server_url, '/blob-store-service/1.0/begin-batch-upload')
-		response = requests.post(url,
+		response = self._transport.post(url,
 			params={
 				'session-id': session_id,
 				'description': description
-			})
-		self.process_response(response)
+			},
+			timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return result['data']
 
 	def commit_batch_upload(self, session_id, batch_id, conflict_behavior='overwrite'):
 		url = join_url(self.server_url, '/blob-store-service/1.0/commit-batch-upload')
-		response = requests.post(url,
+		response = self._transport.post(url,
 			params={
 				'session-id': session_id,
 				'batch-upload-session-id': batch_id,
 				'conflict-behavior': conflict_behavior
-			})
-		self.process_response(response)
+			},
+			timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return result['data']
 
 	def begin_upload(self, session_id, path, namespace_name):
 		url = join_url(self.server_url, '/blob-store-service/1.0/begin-upload')
-		response = requests.post(url,
+		response = self._transport.post(url,
 			params={
 				'session-id': session_id,
 				'blob-name': path,
 				'namespace-name': namespace_name
-			})
-		self.process_response(response)
+			},
+			timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return result['data']
 
 	def commit_upload(self, session_id, upload_id):
 		url = join_url(self.server_url, '/blob-store-service/1.0/commit-upload')
-		response = requests.post(url,
+		response = self._transport.post(url,
 			params={
 				'session-id': session_id,
 				'upload-session-id': upload_id
-			})
-		self.process_response(response)
+			},
+			timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return result['data']
 
 	def put_blob_content_part(self, session_id, upload_id, data, offset=None):
 		url = join_url(self.server_url, '/blob-store-service/1.0/put-blob-content-part')
-		response = requests.post(url,
+		response = self._transport.post(url,
 			params={
 				'session-id': session_id,
 				'upload-session-id': upload_id,
 				'offset': offset if offset else 0,
 				'length': len(data)
 			},
-			data=data)
-		self.process_response(response)
+			data=data,
+			timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return result['data']
 
+	def upload_blob(self, session_id, path, namespace_name, source, chunk_size=None, max_workers=4, max_part_attempts=3):
+		upload = self.begin_upload(session_id, path, namespace_name)
+		self.upload_blob_content(session_id, upload['id'], source, chunk_size, max_workers, max_part_attempts)
+		return self.commit_upload(session_id, upload['id'])
+
+	def upload_blob_content(self, session_id, upload_id, source, chunk_size=None, max_workers=4, max_part_attempts=3, acknowledged=None, on_part=None):
+		# Parts are sent concurrently, the explicit offset lets the server put them together in any order.
+		# A failed part gets requeued on its own, already acknowledged parts are never resent.
+		# Parts are sent once by the transport (see UNRETRIED_ENDPOINTS in retrypolicy.py), their retries are made here, up to max_part_attempts sends.
+		# chunk_size: fixed part size, None tunes it by the measured throughput of the parts (see AdaptiveChunkSizer).
+		# acknowledged: (offset, length) ranges the server has received already (eg. before a restart), these are skipped.
+		# on_part(offset, length) is called whenever a part gets acknowledged.
+		own_source = not isinstance(source, BlobSource)
+		if own_source:
+			source = BlobSource(source)
+		try:
+			pending = collections.deque(BlobServerApi.get_missing_ranges(source.size, acknowledged or []))
+			failures = collections.Counter()
+			if max_workers <= 1 or (len(pending) == 1 and pending[0][1] <= self._get_part_size(chunk_size)):
+				# A single part at a time (eg. small blobs of a BatchUploader) needs no thread pool of its own.
+				while pending:
+					offset, part_length = self._take_part(pending, chunk_size)
+					try:
+						self._put_source_part(session_id, upload_id, source, offset, part_length, BlobServerApi.get_part_retry_delay(failures[offset]), chunk_size is None)
+					except Exception as err:
+						self._requeue_part(pending, failures, offset, part_length, err, max_part_attempts)
+						continue
+					if on_part is not None:
+						on_part(offset, part_length)
+				return
+
+			in_flight = {}
+			with ThreadPoolExecutor(max_workers=max_workers) as executor:
+				try:
+					while pending or in_flight:
+						while pending and len(in_flight) < max_workers:
+							offset, part_length = self._take_part(pending, chunk_size)
+							delay = BlobServerApi.get_part_retry_delay(failures[offset])
+							future = executor.submit(self._put_source_part, session_id, upload_id, source, offset, part_length, delay, chunk_size is None)
+							in_flight[future] = (offset, part_length)
+
+						done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+						for future in done:
+							offset, part_length = in_flight.pop(future)
+							err = future.exception()
+							if err is None:
+								if on_part is not None:
+									on_part(offset, part_length)
+								continue
+							self._requeue_part(pending, failures, offset, part_length, err, max_part_attempts)
+				finally:
+					for future in in_flight:
+						future.cancel()
+		finally:
+			if own_source:
+				source.close()
+
+	def _get_part_size(self, chunk_size):
+		return chunk_size if chunk_size is not None else self.chunk_sizer.get(self.server_url)
+
+	def _take_part(self, pending, chunk_size):
+		offset, length = pending.popleft()
+		part_length = min(length, self._get_part_size(chunk_size))
+		if part_length < length:
+			pending.appendleft((offset + part_length, length - part_length))
+		return offset, part_length
+
+	def _requeue_part(self, pending, failures, offset, part_length, err, max_part_attempts):
+		failures[offset] += 1
+		if failures[offset] >= max_part_attempts or not BlobServerApi.is_retryable_part_error(err):
+			raise err
+		pending.append((offset, part_length))
+		if self._http_options.metrics is not None:
+			self._http_options.metrics.count_retry('blob-store-service/1.0/put-blob-content-part', type(err).__name__)
+
+	def _put_source_part(self, session_id, upload_id, source, offset, length, delay, adaptive):
+		if delay:
+			time.sleep(delay)
+		data = source.read(offset, length)
+		start = time.perf_counter()
+		try:
+			result = self.put_blob_content_part(session_id, upload_id, data, offset=offset)
+		except (requests.Timeout, HttpError) as err:
+			if adaptive and (isinstance(err, requests.Timeout) or err.status_code == 413):
+				self.chunk_sizer.record_failure(self.server_url, length)
+			raise
+		if adaptive:
+			self.chunk_sizer.record(self.server_url, length, time.perf_counter() - start)
+		return result
+
 	def get_blob_content(self, session_id, blob_id):
 		url = join_url(self.server_url, '/blob-store-service/1.0/get-blob-content')
-		response = requests.get(url,
+		response = self._transport.get(url,
 			params={
 				'session-id': session_id,
 				'blob-id': blob_id
 			},
-			stream=True)
-		self.process_response(response, json=False)
-		return response
+			stream=True,
+			timeout=self._http_options.timeout)
+		self.process_stream_response(response)
+		return BlobContent(response)
+
+	def download_blob_to(self, session_id, blob_id, target, content_hash=None, content_hash_algorithm=DEFAULT_CONTENT_HASH_ALGORITHM, size=None, buffer_size=DOWNLOAD_BUFFER_SIZE):
+		# Content is hashed while it's being written, so verification needs no second read pass.
+		# Paths are written through a temporary file in the same directory, and renamed only when verified.
+		# Returns the downloaded size and the content hash in the Blob Server format.
+		content = self.get_blob_content(session_id, blob_id)
+		try:
+			if size is None:
+				size = content.size
+
+			if not isinstance(target, (str, os.PathLike)):
+				written, digest = BlobServerApi.write_content(content, target, content_hash_algorithm, buffer_size)
+				BlobServerApi.verify_content_hash(digest, content_hash)
+				return written, encode_digest(digest)
+
+			target = os.fspath(target)
+			fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(target) + '.', suffix='.part', dir=os.path.dirname(os.path.abspath(target)))
+			try:
+				with os.fdopen(fd, 'wb', buffering=buffer_size) as f:
+					if size and hasattr(os, 'posix_fallocate'):
+						try:
+							os.posix_fallocate(f.fileno(), 0, size)
+						except OSError:
+							pass # Not supported by every file system, it's an optimization only.
+					written, digest = BlobServerApi.write_content(content, f, content_hash_algorithm, buffer_size)
+					f.truncate(written)
+				BlobServerApi.verify_content_hash(digest, content_hash)
+				# Temporary files are owner-only, downloads get the mode of the replaced file, or of a newly created one.
+				os.chmod(temp_path, BlobServerApi.get_target_mode(target))
+				os.replace(temp_path, target)
+			except:
+				os.remove(temp_path)
+				raise
+			return written, encode_digest(digest)
+		finally:
+			content.close()
+
+	@staticmethod
+	def get_target_mode(target):
+		try:
+			return os.stat(target).st_mode & 0o7777
+		except FileNotFoundError:
+			return 0o666 & ~UMASK
+
+	@staticmethod
+	def write_content(content, f, content_hash_algorithm, buffer_size):
+		# A single buffer is reused for the whole blob.
+		hasher = create_hasher(content_hash_algorithm)
+		buffer = bytearray(buffer_size)
+		view = memoryview(buffer)
+		written = 0
+		while True:
+			size = content.readinto(buffer)
+			if not size:
+				break
+			hasher.update(view[:size])
+			f.write(view[:size])
+			written += size
+		return written, hasher.digest()
+
+	@staticmethod
+	def verify_content_hash(digest, content_hash):
+		if content_hash is not None and not content_hash_matches(digest, content_hash):
+			raise ContentHashError(content_hash, encode_digest(digest))
+
+	@staticmethod
+	def get_missing_ranges(size, acknowledged):
+		# Complement of the acknowledged ranges within [0, size).
+		missing = []
+		offset = 0
+		for start, length in sorted(acknowledged):
+			if start > offset:
+				missing.append((offset, min(start, size) - offset))
+			offset = max(offset, start + length)
+			if offset >= size:
+				break
+		if offset < size:
+			missing.append((offset, size - offset))
+		return [(start, length) for start, length in missing if length > 0]
+
+	@staticmethod
+	def get_part_retry_delay(failures):
+		return 0 if failures == 0 else min(0.5 * 2 ** (failures - 1), 10)
+
+	@staticmethod
+	def is_retryable_part_error(err):
+		if isinstance(err, (requests.ConnectionError, requests.Timeout)):
+			return True
+		if isinstance(err, HttpError):
+			# 413: the part gets split by the shrunk chunk size when it's sent again.
+			return err.status_code >= 500 or err.status_code in (413, 429)
+		if isinstance(err, BIMcloudBlobServerError):
+			# 13: InvalidBlobContentPart
+			return err.code == 13
+		return False
+
+	@staticmethod
+	def process_stream_response(response):
+		# The body of a successful streamed response is left unread, only error bodies are read (see process_response).
+		if response.ok:
+			return response
+		try:
+			BlobServerApi.process_response(response, json=False)
+		finally:
+			response.close()
 
 	@staticmethod
 	def process_response(response, json=True):
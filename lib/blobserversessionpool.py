@@ -0,0 +1,210 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .blobserverapi import BlobServerApi
+from .errors import BIMcloudBlobServerError
+
+# 4: AccessControlTicketExpired, 11: SessionNotFound
+SESSION_EXPIRED_ERROR_CODES = (4, 11)
+
+class BlobServerSession:
+	def __init__(self, model_server_id, session_id, api):
+		self.model_server_id = model_server_id
+		self.session_id = session_id
+		self.api = api
+
+class _ServerState:
+	def __init__(self, api):
+		self.api = api
+		self.condition = threading.Condition()
+		self.idle = []
+		self.live = 0
+		# Session creation is serialized per server, so expiring sessions don't start renewal storms.
+		self.renew_lock = threading.Lock()
+		self.tickets = collections.deque()
+		self.prefetching = 0
+
+class BlobServerSessionPool:
+	# Keeps several live Blob Server sessions per Model Server, and lends them out one caller at a time.
+	# Tickets for new sessions are fetched from the Manager ahead of time.
+	def __init__(self, manager_api, auth_context, username, url_selector, http_options=None, max_sessions_per_server=4, ticket_prefetch=1, ticket_ttl=60, max_attempts=3):
+		self._manager_api = manager_api
+		self._auth_context = auth_context
+		self._username = username
+		self._url_selector = url_selector
+		self._http_options = http_options
+		self._max_sessions_per_server = max_sessions_per_server
+		self._ticket_prefetch = ticket_prefetch
+		self._ticket_ttl = ticket_ttl
+		self._max_attempts = max_attempts
+		self._lock = threading.Lock()
+		self._servers = {}
+		self._prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='bimcloud-ticket-prefetch')
+		self._closed = False
+
+	def run(self, model_server, fn):
+		# Runs fn(session_id, blob_server_api) with a pooled session.
+		# Expired sessions are dropped and the call is retried with another one,
+		# unreachable urls are failed over to the next best url, max_attempts times at most.
+		attempt = 0
+		while True:
+			attempt += 1
+			session = self.acquire(model_server)
+			try:
+				result = fn(session.session_id, session.api)
+			except BIMcloudBlobServerError as err:
+				expired = err.code in SESSION_EXPIRED_ERROR_CODES
+				self.release(session, discard=expired)
+				if expired and attempt < self._max_attempts:
+					self._count_retry(f'session expired ({err.code})')
+					continue
+				raise err
+			except (requests.ConnectionError, requests.Timeout):
+				self.release(session, discard=True)
+				if attempt >= self._max_attempts:
+					raise
+				self._failover(model_server, session.api)
+				self._count_retry('failover')
+				continue
+			except:
+				self.release(session)
+				raise
+			self.release(session)
+			return result
+
+	def acquire(self, model_server):
+		state = self._get_state(model_server)
+		with state.condition:
+			while True:
+				if self._closed:
+					raise RuntimeError('Blob Server session pool is closed.')
+				if state.idle:
+					return state.idle.pop()
+				if state.live < self._max_sessions_per_server:
+					state.live += 1
+					break
+				state.condition.wait()
+
+		try:
+			with state.renew_lock:
+				session = self._create_session(model_server, state)
+		except:
+			with state.condition:
+				state.live -= 1
+				state.condition.notify()
+			raise
+		self._prefetch_tickets(model_server, state)
+		return session
+
+	def release(self, session, discard=False):
+		with self._lock:
+			state = self._servers.get(session.model_server_id)
+		close = discard or self._closed or state is None or session.api is not state.api
+		if state is not None:
+			with state.condition:
+				if close:
+					state.live -= 1
+				else:
+					state.idle.append(session)
+				state.condition.notify()
+		if close:
+			BlobServerSessionPool._close_session(session)
+
+	def close(self):
+		self._closed = True
+		self._prefetch_executor.shutdown(wait=True)
+		with self._lock:
+			states = list(self._servers.values())
+		for state in states:
+			with state.condition:
+				idle = state.idle
+				state.idle = []
+				state.live -= len(idle)
+				state.condition.notify_all()
+			for session in idle:
+				BlobServerSessionPool._close_session(session)
+			state.api.close()
+
+	def _get_state(self, model_server):
+		with self._lock:
+			state = self._servers.get(model_server['id'])
+		if state is None:
+			# Url selection could take a while, other servers shouldn't wait for it.
+			url = self._url_selector.select(model_server)
+			with self._lock:
+				state = self._servers.setdefault(model_server['id'], _ServerState(BlobServerApi(url, http_options=self._http_options)))
+		return state
+
+	def _create_session(self, model_server, state):
+		api = state.api
+		ticket = self._take_ticket(model_server, state)
+		try:
+			session_id = api.create_session(self._username, ticket)
+		except BIMcloudBlobServerError as err:
+			# A prefetched ticket could expire while waiting, try again with a brand new one.
+			if err.code not in (3, 4):
+				raise
+			session_id = api.create_session(self._username, self._manager_api.get_ticket(self._auth_context, model_server['id']))
+		return BlobServerSession(model_server['id'], session_id, api)
+
+	def _take_ticket(self, model_server, state):
+		with state.condition:
+			while state.tickets:
+				ticket, fetched_at = state.tickets.popleft()
+				if time.monotonic() - fetched_at < self._ticket_ttl:
+					return ticket
+		return self._manager_api.get_ticket(self._auth_context, model_server['id'])
+
+	def _prefetch_tickets(self, model_server, state):
+		with state.condition:
+			# Tickets are worth having only while further sessions could be created.
+			if state.live >= self._max_sessions_per_server:
+				return
+			missing = self._ticket_prefetch - len(state.tickets) - state.prefetching
+			state.prefetching += max(0, missing)
+		for _ in range(missing):
+			try:
+				self._prefetch_executor.submit(self._prefetch_ticket, model_server, state)
+			except RuntimeError:
+				with state.condition:
+					state.prefetching -= 1
+
+	def _prefetch_ticket(self, model_server, state):
+		try:
+			ticket = self._manager_api.get_ticket(self._auth_context, model_server['id'])
+			with state.condition:
+				state.tickets.append((ticket, time.monotonic()))
+		except Exception:
+			pass # Prefetching is an optimization only, tickets are fetched on demand as well.
+		finally:
+			with state.condition:
+				state.prefetching -= 1
+
+	def _failover(self, model_server, failed_api):
+		# Only the first caller switches to the next url, the others find the state already updated.
+		state = self._get_state(model_server)
+		with state.renew_lock:
+			if state.api is not failed_api:
+				return
+			url = self._url_selector.failover(model_server, failed_api.server_url)
+			with state.condition:
+				state.api = BlobServerApi(url, http_options=self._http_options)
+				idle = [session for session in state.idle if session.api is failed_api]
+				state.idle = [session for session in state.idle if session.api is not failed_api]
+				state.live -= len(idle)
+				state.condition.notify_all()
+			failed_api.close()
+
+	def _count_retry(self, reason):
+		metrics = self._http_options.metrics if self._http_options is not None else None
+		if metrics is not None:
+			metrics.count_retry('blob-server-session', reason)
+
+	@staticmethod
+	def _close_session(session):
+		try:
+			session.api.close_session(session.session_id)
+		except Exception:
+			pass # Session expires on the server anyway.
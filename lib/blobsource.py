@@ -0,0 +1,39 @@
+import os
+import threading
+
+class BlobSource:
+	# Thread-safe random access to upload content, so chunks can be read (and sent) out of order.
+	def __init__(self, source):
+		self._data = None
+		self._file = None
+		self._lock = threading.Lock()
+		if isinstance(source, (bytes, bytearray, memoryview)):
+			self._data = memoryview(source)
+			self.size = len(self._data)
+			self.path = None
+		elif isinstance(source, (str, os.PathLike)):
+			self.path = os.fspath(source)
+			self._file = open(self.path, 'rb')
+			self.size = os.fstat(self._file.fileno()).st_size
+		else:
+			raise ValueError('"source" should be bytes-like or a file path.')
+
+	def read(self, offset, length):
+		if self._data is not None:
+			return bytes(self._data[offset:offset + length])
+		if hasattr(os, 'pread'):
+			return os.pread(self._file.fileno(), length, offset)
+		with self._lock:
+			self._file.seek(offset)
+			return self._file.read(length)
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
@@ -0,0 +1,107 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from .jobwaiter import JobWaiter
+
+class BulkDeleteReport:
+	def __init__(self, ids, not_found):
+		# Ids actually submitted for deletion (ancestors cover the rest), and paths/ids which don't exist.
+		self.ids = ids
+		self.not_found = not_found
+		self.jobs = []
+		# (ids, exception) pairs of chunks which couldn't get submitted or tracked.
+		self.errors = []
+
+	@property
+	def failed_jobs(self):
+		return [job for job in self.jobs if job['status'] != 'completed']
+
+	@property
+	def succeeded(self):
+		return not self.errors and not self.failed_jobs
+
+	@property
+	def result_codes(self):
+		return collections.Counter(job.get('resultCode') for job in self.jobs)
+
+	@property
+	def progress(self):
+		# Overall progress of the jobs between 0 and 1.
+		done = 0
+		total = 0
+		for job in self.jobs:
+			progress = job.get('progress') or {}
+			minimum = progress.get('min', 0)
+			maximum = progress.get('max', 0)
+			done += max(0, progress.get('current', minimum) - minimum)
+			total += max(0, maximum - minimum)
+		return done / total if total else 1.0
+
+class BulkDeleter:
+	# Deletes arbitrary sets of resources through delete-resources-by-id-list.
+	# Resources with a selected ancestor are left out (the ancestor takes them anyway),
+	# the rest is split into chunks, which are submitted concurrently and tracked as jobs.
+	def __init__(self, manager_api, auth_context, job_waiter=None, chunk_size=100, max_workers=4, max_items_per_query=100):
+		self._manager_api = manager_api
+		self._auth_context = auth_context
+		self._job_waiter = job_waiter
+		self._chunk_size = chunk_size
+		self._max_workers = max_workers
+		self._max_items_per_query = max_items_per_query
+
+	def plan(self, paths=(), ids=(), resources=()):
+		# Returns ids to delete, and the paths/ids that were not found.
+		# resources: already fetched resources (eg. by TreeWalker), these aren't queried again.
+		resources = { resource['id']: resource for resource in resources }
+		not_found = []
+		for key, values in (('$path', list(paths)), ('id', list(ids))):
+			found = self._get_resources(key, values)
+			for value in values:
+				resource = found.get(value.lower() if key == '$path' else value)
+				if resource is None:
+					not_found.append(value)
+				else:
+					resources[resource['id']] = resource
+
+		result = [
+			resource_id for resource_id, resource in resources.items()
+			if not any(ancestor.get('id') in resources for ancestor in resource.get('$ancestors') or [])
+		]
+		return result, not_found
+
+	def delete(self, paths=(), ids=(), on_progress=None, resources=()):
+		# on_progress(job) is called as the jobs of the chunks make progress.
+		# Every chunk invalidates the cache of the ManagerApi once (see ResourceCache.invalidate_subtrees).
+		planned_ids, not_found = self.plan(paths, ids, resources)
+		report = BulkDeleteReport(planned_ids, not_found)
+		chunks = [planned_ids[i:i + self._chunk_size] for i in range(0, len(planned_ids), self._chunk_size)]
+		if not chunks:
+			return report
+
+		job_waiter = self._job_waiter if self._job_waiter is not None else JobWaiter(self._manager_api, self._auth_context)
+		try:
+			with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+				submissions = [(chunk, executor.submit(self._manager_api.delete_resources_by_id_list, self._auth_context, chunk)) for chunk in chunks]
+				waits = []
+				for chunk, submission in submissions:
+					try:
+						waits.append((chunk, job_waiter.wait_for(submission.result(), on_progress)))
+					except Exception as err:
+						report.errors.append((chunk, err))
+			for chunk, future in waits:
+				try:
+					report.jobs.append(future.result())
+				except Exception as err:
+					report.errors.append((chunk, err))
+		finally:
+			if self._job_waiter is None:
+				job_waiter.close()
+		return report
+
+	def _get_resources(self, key, values):
+		# Fetches resources by many paths or ids with a few $or queries. Paths are case insensitive.
+		result = {}
+		for i in range(0, len(values), self._max_items_per_query):
+			criterion = { '$or': [{ '$eq': { key: value } } for value in values[i:i + self._max_items_per_query]] }
+			for resource in self._manager_api.get_resources_by_criterion(self._auth_context, criterion):
+				result[resource[key].lower() if key == '$path' else resource[key]] = resource
+		return result
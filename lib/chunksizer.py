@@ -0,0 +1,83 @@
+import threading
+
+class _ServerChunkState:
+	def __init__(self, size, max_size):
+		self.size = size
+		# Upper bound learned from failures (timeouts, 413), sizes above it aren't tried again.
+		self.max_size = max_size
+		self.best_size = None
+		self.best_throughput = None
+		self.settled = False
+		self.sample_bytes = 0
+		self.sample_seconds = 0.0
+		self.sample_count = 0
+
+class AdaptiveChunkSizer:
+	# Tunes the upload chunk size per Blob Server url. It starts small, and doubles the size while the measured throughput
+	# of the parts improves by at least min_improvement. When it doesn't, the best size is kept.
+	# Timeouts and "413 Payload Too Large" responses halve the size, and cap it for the server from then on.
+	def __init__(self, initial_size=256 * 1024, min_size=64 * 1024, max_size=64 * 1024 * 1024, samples=4, min_improvement=0.1):
+		if not min_size <= initial_size <= max_size:
+			raise ValueError('"initial_size" should be between "min_size" and "max_size".')
+		self.initial_size = initial_size
+		self.min_size = min_size
+		self.max_size = max_size
+		# Parts measured before the size is changed.
+		self.samples = samples
+		self.min_improvement = min_improvement
+		self._lock = threading.Lock()
+		self._servers = {}
+
+	def get(self, server_url):
+		with self._lock:
+			return self._get_state(server_url).size
+
+	def record(self, server_url, size, seconds):
+		# Parts of a different size than the current one (eg. the last part of a blob, or sent before a change) aren't measured.
+		with self._lock:
+			state = self._get_state(server_url)
+			if size != state.size or seconds <= 0:
+				return
+			state.sample_bytes += size
+			state.sample_seconds += seconds
+			state.sample_count += 1
+			if state.sample_count < self.samples:
+				return
+			throughput = state.sample_bytes / state.sample_seconds
+			AdaptiveChunkSizer._reset_samples(state)
+			if state.settled:
+				return
+			if state.best_throughput is None or throughput >= state.best_throughput * (1 + self.min_improvement):
+				state.best_size = state.size
+				state.best_throughput = throughput
+				if state.size < state.max_size:
+					state.size = min(state.size * 2, state.max_size)
+					return
+			state.size = state.best_size
+			state.settled = True
+
+	def record_failure(self, server_url, size):
+		# A part of this size timed out or was too large.
+		with self._lock:
+			state = self._get_state(server_url)
+			state.max_size = max(self.min_size, min(state.max_size, size // 2))
+			state.size = min(state.size, state.max_size)
+			if state.best_size is not None and state.best_size > state.max_size:
+				state.best_size = None
+				state.best_throughput = None
+			AdaptiveChunkSizer._reset_samples(state)
+
+	def _get_state(self, server_url):
+		state = self._servers.get(server_url)
+		if state is None:
+			state = self._servers[server_url] = _ServerChunkState(self.initial_size, self.max_size)
+		return state
+
+	@staticmethod
+	def _reset_samples(state):
+		state.sample_bytes = 0
+		state.sample_seconds = 0.0
+		state.sample_count = 0
+
+# Learned sizes are kept for the lifetime of the process, shared by every BlobServerApi by default.
+DEFAULT_CHUNK_SIZER = AdaptiveChunkSizer()
@@ -0,0 +1,26 @@
+import base64
+import binascii
+import hashlib
+
+DEFAULT_CONTENT_HASH_ALGORITHM = 'SHA256'
+
+def create_hasher(algorithm=DEFAULT_CONTENT_HASH_ALGORITHM):
+	return hashlib.new(algorithm.replace('-', '').lower())
+
+def encode_digest(digest):
+	# Blob Server reports content-hash as unpadded base64url, eg.: E_UXOOjE-SDi-g_Tq6F7dQAd1dp-C5aLTIy1ThHFvFQ
+	return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+def decode_content_hash(content_hash):
+	# Accepts the Blob Server format as well as plain hex digests.
+	try:
+		return bytes.fromhex(content_hash)
+	except ValueError:
+		pass
+	try:
+		return base64.urlsafe_b64decode(content_hash + '=' * (-len(content_hash) % 4))
+	except (binascii.Error, ValueError):
+		return None
+
+def content_hash_matches(digest, content_hash):
+	return decode_content_hash(content_hash) == digest
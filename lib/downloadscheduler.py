@@ -0,0 +1,122 @@
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class DownloadOutcome:
+	def __init__(self, blob, target, size=None, content_hash=None, error=None):
+		self.blob = blob
+		self.target = target
+		self.size = size
+		self.content_hash = content_hash
+		self.error = error
+
+	@property
+	def ok(self):
+		return self.error is None
+
+class DownloadScheduler:
+	# Downloads many blobs at once. Blobs are queued by their Model Server,
+	# and downloads are started round-robin across the servers, within a per server and a global limit,
+	# so blobs of a busy server don't hold back the others.
+	def __init__(self, manager_api, auth_context, run_with_blob_server_session, max_per_server=4, max_total=8):
+		self._manager_api = manager_api
+		self._auth_context = auth_context
+		self._run_with_blob_server_session = run_with_blob_server_session
+		self._max_per_server = max_per_server
+		self._max_total = max_total
+
+	def download(self, items, on_outcome=None):
+		# items: (blob, target path) pairs, blobs as returned by the Manager API,
+		# or (blob, target path, content hash) triples to verify the downloads with known hashes (see download_blob_to).
+		# Items could come from a generator (eg. a TreeWalker walk), they're taken a few at a time as downloads get started,
+		# so downloading starts before every item is known.
+		# Returns a DownloadOutcome for every item in the same order. A failed download doesn't stop the others.
+		items = iter(items)
+		entries = []
+		outcomes = []
+		queues = collections.OrderedDict()
+		model_servers = {}
+		model_server_errors = {}
+
+		def finish(index, outcome):
+			outcomes[index] = outcome
+			if on_outcome is not None:
+				on_outcome(outcome)
+
+		def take():
+			# Queues the next item, returns False when there are no more.
+			item = next(items, None)
+			if item is None:
+				return False
+			index = len(entries)
+			blob, target = item[0], item[1]
+			entries.append((blob, target, item[2] if len(item) > 2 else None))
+			outcomes.append(None)
+			model_server_id = blob['modelServerId']
+			if model_server_id not in model_servers and model_server_id not in model_server_errors:
+				try:
+					model_servers[model_server_id] = self._manager_api.get_resource_by_id(self._auth_context, model_server_id)
+				except Exception as err:
+					model_server_errors[model_server_id] = err
+			if model_server_id in model_server_errors:
+				finish(index, DownloadOutcome(blob, target, error=model_server_errors[model_server_id]))
+			else:
+				queues.setdefault(model_server_id, collections.deque()).append(index)
+			return True
+
+		running = collections.Counter()
+		in_flight = {}
+
+		def start(executor):
+			# Starts queued downloads round-robin across the servers, within the limits.
+			started = True
+			while started and len(in_flight) < self._max_total:
+				started = False
+				for model_server_id in list(queues):
+					if len(in_flight) >= self._max_total:
+						break
+					if running[model_server_id] >= self._max_per_server:
+						continue
+					queue = queues[model_server_id]
+					index = queue.popleft()
+					if not queue:
+						del queues[model_server_id]
+					blob, target, content_hash = entries[index]
+					future = executor.submit(self._download, model_servers[model_server_id], blob, target, content_hash)
+					in_flight[future] = (model_server_id, index)
+					running[model_server_id] += 1
+					started = True
+
+		exhausted = False
+		with ThreadPoolExecutor(max_workers=self._max_total) as executor:
+			while True:
+				# Items are read ahead up to max_total queued ones, so there are blobs of several servers to choose from.
+				# Downloads are started after each of them, so they don't wait for the read ahead.
+				start(executor)
+				while not exhausted and sum(len(queue) for queue in queues.values()) < self._max_total:
+					exhausted = not take()
+					start(executor)
+
+				if not in_flight:
+					if exhausted and not queues:
+						break
+					continue
+
+				done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+				for future in done:
+					model_server_id, index = in_flight.pop(future)
+					running[model_server_id] -= 1
+					blob, target, _ = entries[index]
+					err = future.exception()
+					if err is None:
+						size, content_hash = future.result()
+						finish(index, DownloadOutcome(blob, target, size, content_hash))
+					else:
+						finish(index, DownloadOutcome(blob, target, error=err))
+		return outcomes
+
+	def _download(self, model_server, blob, target, content_hash):
+		target_dir = os.path.dirname(os.path.abspath(target))
+		os.makedirs(target_dir, exist_ok=True)
+		return self._run_with_blob_server_session(model_server,
+			lambda session_id, api: api.download_blob_to(session_id, blob['id'], target, content_hash=content_hash))
@@ -52,13 +52,13 @@ BLOB_SERVER_ERRORS = {
 def get_manager_error_id(code):
 	name = MANGER_ERRORS.get(code)
 	if name is None:
-		'UnknownBIMcloudManagerError'
+		name = 'UnknownBIMcloudManagerError'
 	return name
 
 def get_blob_server_error_id(code):
 	name = BLOB_SERVER_ERRORS.get(code)
 	if name is None:
-		'UnknownBIMcloudBlobServerError'
+		name = 'UnknownBIMcloudBlobServerError'
 	return name
 
 def raise_bimcloud_manager_error(error_content):
@@ -89,4 +89,10 @@ class HttpError(Exception):
 			self.message = f'HttpErrror: status={self.status_code}, reason={self.text or self.reason}.'
 			return
 		self.reason = response.reason
-		self.message = f'HttpErrror: status={self.status_code}. {self.text or self.reason}.'
\ No newline at end of file
+		self.message = f'HttpErrror: status={self.status_code}. {self.text or self.reason}.'
+
+class ContentHashError(Exception):
+	def __init__(self, expected, actual):
+		self.expected = expected
+		self.actual = actual
+		self.message = f'Content hash mismatch: expected={expected}, actual={actual}.'
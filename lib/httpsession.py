@@ -0,0 +1,37 @@
+import requests
+from requests.adapters import HTTPAdapter
+from .retrypolicy import RetryPolicy
+
+class HttpSessionOptions:
+	def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True, connect_timeout=10, read_timeout=300, middlewares=None, metrics=None, retry_policy=None):
+		# pool_connections: number of per-host pools kept alive,
+		# pool_maxsize: maximum number of reusable connections per host,
+		# pool_block: wait for a free connection instead of opening extra (non-pooled) ones.
+		# middlewares: request middlewares of the API transports (see Transport in transport.py),
+		# metrics: Metrics to record requests, retries and token refreshes into (see metrics.py),
+		# retry_policy: retries of failed requests (see RetryPolicy in retrypolicy.py), RetryPolicy(max_attempts=1) turns them off.
+		self.pool_connections = pool_connections
+		self.pool_maxsize = pool_maxsize
+		self.pool_block = pool_block
+		self.keep_alive = keep_alive
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self.middlewares = list(middlewares or [])
+		self.metrics = metrics
+		self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+	@property
+	def timeout(self):
+		return (self.connect_timeout, self.read_timeout)
+
+def create_http_session(options=None):
+	if options is None:
+		options = HttpSessionOptions()
+
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=options.pool_connections, pool_maxsize=options.pool_maxsize, pool_block=options.pool_block)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	if not options.keep_alive:
+		session.headers['Connection'] = 'close'
+	return session
@@ -0,0 +1,147 @@
+import heapq
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+FINAL_JOB_STATUSES = ('completed', 'failed', 'aborted', 'abort failed')
+
+class _TrackedJob:
+	def __init__(self, job_id, future, on_progress, interval):
+		self.job_id = job_id
+		self.future = future
+		self.on_progress = on_progress
+		self.interval = interval
+		self.last_state = None
+
+class JobWaiter:
+	# Tracks many Manager jobs at once, and resolves a future for each when it reaches a final status.
+	# Polling backs off exponentially (with jitter) while a job makes no progress, and speeds up again when it does.
+	def __init__(self, manager_api, auth_context, min_interval=0.1, max_interval=5, backoff_factor=2, jitter=0.2, max_workers=4):
+		self._manager_api = manager_api
+		self._auth_context = auth_context
+		self._min_interval = min_interval
+		self._max_interval = max_interval
+		self._backoff_factor = backoff_factor
+		self._jitter = jitter
+		self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bimcloud-job-poll')
+		self._condition = threading.Condition()
+		self._schedule = []
+		self._jobs = {}
+		self._closed = False
+		self._thread = threading.Thread(target=self._run, name='bimcloud-job-waiter', daemon=True)
+		self._thread.start()
+
+	def wait_for(self, job, on_progress=None):
+		# job: a job object (eg. the result of delete_resources_by_id_list) or a job id.
+		# on_progress(job) is called whenever the status or the progress of the job changes.
+		# Cancelling the returned future aborts the job.
+		job_id = job['id'] if isinstance(job, dict) else job
+		future = Future()
+		tracked = _TrackedJob(job_id, future, on_progress, self._min_interval)
+		if isinstance(job, dict) and job.get('status') in FINAL_JOB_STATUSES:
+			future.set_result(job)
+			return future
+
+		with self._condition:
+			if self._closed:
+				raise RuntimeError('Job waiter is closed.')
+			self._jobs[job_id] = tracked
+			self._push(tracked, 0)
+		future.add_done_callback(lambda f: self._on_done(job_id, f))
+		return future
+
+	def wait_for_all(self, jobs, on_progress=None):
+		return [self.wait_for(job, on_progress) for job in jobs]
+
+	def cancel(self, job_id):
+		# Requests abort, the job's future resolves when the job reaches its final (aborted) status.
+		return self._manager_api.abort_job(self._auth_context, job_id)
+
+	def close(self):
+		with self._condition:
+			self._closed = True
+			jobs = list(self._jobs.values())
+			self._jobs.clear()
+			self._condition.notify_all()
+		self._thread.join()
+		self._executor.shutdown(wait=True)
+		for tracked in jobs:
+			tracked.future.cancel()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _push(self, tracked, delay):
+		heapq.heappush(self._schedule, (time.monotonic() + delay, tracked.job_id))
+		self._condition.notify()
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while not self._closed:
+					now = time.monotonic()
+					if self._schedule and self._schedule[0][0] <= now:
+						break
+					self._condition.wait(self._schedule[0][0] - now if self._schedule else None)
+				if self._closed:
+					return
+				due = []
+				while self._schedule and self._schedule[0][0] <= now:
+					tracked = self._jobs.get(heapq.heappop(self._schedule)[1])
+					if tracked is not None:
+						due.append(tracked)
+			for tracked in due:
+				self._executor.submit(self._poll, tracked)
+
+	def _poll(self, tracked):
+		try:
+			job = self._manager_api.get_job(self._auth_context, tracked.job_id)
+		except Exception as err:
+			# EntityNotFoundError (6) for example means that the job has been removed already.
+			self._finish(tracked, exception=err)
+			return
+
+		state = (job.get('status'), job.get('progress'))
+		changed = state != tracked.last_state
+		tracked.last_state = state
+		if changed and tracked.on_progress is not None:
+			try:
+				tracked.on_progress(job)
+			except Exception:
+				pass # Callbacks shouldn't break polling.
+
+		if job.get('status') in FINAL_JOB_STATUSES:
+			self._finish(tracked, result=job)
+			return
+
+		tracked.interval = self._min_interval if changed else min(tracked.interval * self._backoff_factor, self._max_interval)
+		delay = tracked.interval * random.uniform(1 - self._jitter, 1 + self._jitter)
+		with self._condition:
+			if tracked.job_id in self._jobs:
+				self._push(tracked, delay)
+
+	def _finish(self, tracked, result=None, exception=None):
+		with self._condition:
+			self._jobs.pop(tracked.job_id, None)
+		# Futures cancelled by their callers are left as they are.
+		if not tracked.future.set_running_or_notify_cancel():
+			return
+		if exception is not None:
+			tracked.future.set_exception(exception)
+		else:
+			tracked.future.set_result(result)
+
+	def _on_done(self, job_id, future):
+		if not future.cancelled():
+			return
+		with self._condition:
+			tracked = self._jobs.pop(job_id, None)
+		if tracked is not None:
+			try:
+				self.cancel(job_id)
+			except Exception:
+				pass # Job could have been finished already.
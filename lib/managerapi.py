@@ -1,8 +1,24 @@
-import requests
-from .errors import raise_bimcloud_manager_error, HttpError
-from .url import is_url, join_url, add_params
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .errors import raise_bimcloud_manager_error, HttpError, BIMcloudManagerError
+from .url import is_url, join_url, add_params, get_endpoint
+from .httpsession import HttpSessionOptions
+from .transport import create_transport
+from .resources import ResourceDecoder, loads
+from .jobwaiter import FINAL_JOB_STATUSES
 import webbrowser
 
+# Query APIs return 1000 items at most.
+MAX_RESULT_LIMIT = 1000
+
+# Access tokens get refreshed this many seconds before they expire,
+# but at most half of their lifetime before, so short-lived tokens aren't refreshed on every request.
+DEFAULT_REFRESH_MARGIN = 60
+
+# The background refresher waits at least this many seconds between refreshes.
+MIN_REFRESH_INTERVAL = 1
+
 class ManagerApiRequestContext:
 	def __init__(self, user_id, access_token, refresh_token, access_token_exp, token_type, client_id):
 		self.user_id = user_id
@@ -11,15 +27,92 @@ class ManagerApiRequestContext:
 		self.access_token_exp = access_token_exp
 		self.token_type = token_type
 		self.client_id = client_id
+		self.issued_at = time.time()
+		# Serializes token refreshes, so concurrent callers send a single refresh grant.
+		self._refresh_lock = threading.Lock()
+		self._async_refresh_lock = None
+		self.refresh_count = 0
+		self.refresh_seconds_total = 0.0
+		self.last_refresh_seconds = None
+
+	def expires_within(self, seconds):
+		return self.access_token_exp is not None and self.access_token_exp - seconds <= time.time()
+
+	def get_refresh_margin(self, margin):
+		if self.access_token_exp is None:
+			return margin
+		return max(0, min(margin, (self.access_token_exp - self.issued_at) / 2))
+
+	def should_refresh(self, margin):
+		return self.expires_within(self.get_refresh_margin(margin))
+
+	def update_tokens(self, refreshed_context, elapsed_seconds):
+		self._access_token = refreshed_context._access_token
+		self._refresh_token = refreshed_context._refresh_token
+		self.access_token_exp = refreshed_context.access_token_exp
+		self.issued_at = refreshed_context.issued_at
+		self.refresh_count += 1
+		self.refresh_seconds_total += elapsed_seconds
+		self.last_refresh_seconds = elapsed_seconds
+
+class TokenRefresher:
+	# Refreshes the access token of a context in the background, shortly before it expires.
+	def __init__(self, manager_api, auth_context, margin=DEFAULT_REFRESH_MARGIN, retry_delay=5, min_interval=MIN_REFRESH_INTERVAL):
+		self._manager_api = manager_api
+		self._auth_context = auth_context
+		self._margin = margin
+		self._retry_delay = retry_delay
+		self._min_interval = min_interval
+		self._stopped = threading.Event()
+		self._thread = threading.Thread(target=self._run, name='bimcloud-token-refresher', daemon=True)
+
+	def start(self):
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._stopped.set()
+		if self._thread.is_alive():
+			self._thread.join()
+
+	def _run(self):
+		while not self._stopped.is_set():
+			auth_context = self._auth_context
+			if auth_context.access_token_exp is None:
+				# Tokens without expiry aren't refreshed in advance, a later one could have it though.
+				self._stopped.wait(self._retry_delay)
+				continue
+			delay = auth_context.access_token_exp - auth_context.get_refresh_margin(self._margin) - time.time()
+			if delay > 0:
+				self._stopped.wait(delay)
+				continue
+			try:
+				self._manager_api.refresh_token(auth_context, auth_context._access_token)
+			except Exception:
+				# Requests will refresh on their own (on 401 at least), we just try again later.
+				self._stopped.wait(self._retry_delay)
+				continue
+			self._stopped.wait(self._min_interval)
 
 class ManagerApi:
-	def __init__(self, manager_url, safe=True):
+	def __init__(self, manager_url, safe=True, http_options=None, session=None, cache=None, refresh_margin=DEFAULT_REFRESH_MARGIN):
 		if not is_url(manager_url):
 			raise ValueError('Manager url is invalid.')
 
 		self.manager_url = manager_url
 		self._api_root = join_url(manager_url, 'management/client')
 		self._safe = safe
+		self._http_options = http_options if http_options is not None else HttpSessionOptions()
+		self._transport = create_transport(self._http_options, session)
+		# Optional ResourceCache for get-resource results:
+		self.cache = cache
+		# Job id -> resource ids of running delete jobs, their subtrees are invalidated again when the job is done (see get_job).
+		self._pending_deletes = {}
+		self._pending_deletes_lock = threading.Lock()
+		self._refresh_margin = refresh_margin
+
+	def close(self):
+		self._transport.close()
 
 	def open_authorization_page(self, client_id, state):
 		url = add_params(join_url(self._api_root, 'oauth2', 'authorize'), { 'client_id': client_id, 'state': state })
@@ -27,7 +120,7 @@ class ManagerApi:
 
 	def get_authorization_code_by_state(self, state):
 		url = join_url(self._api_root, 'oauth2', 'get-authorization-code-by-state')
-		response = requests.get(url, params={ 'state': state }, verify=self._safe)
+		response = self._transport.get(url, params={ 'state': state }, verify=self._safe, timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return result['status'], result['code']
 
@@ -39,7 +132,7 @@ class ManagerApi:
 			'client_id': client_id
 		}
 		url = join_url(self._api_root, 'oauth2', 'token')
-		response = requests.post(url, data=request, headers={ 'Content-Type': 'application/x-www-form-urlencoded' }, verify=self._safe)
+		response = self._transport.post(url, data=request, headers={ 'Content-Type': 'application/x-www-form-urlencoded' }, verify=self._safe, timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return ManagerApiRequestContext(result['user_id'], result['access_token'], result['refresh_token'], result['access_token_exp'], result['token_type'], client_id)
 
@@ -50,7 +143,7 @@ class ManagerApi:
 			'client_id': client_id
 		}
 		url = join_url(self._api_root, 'oauth2', 'token')
-		response = requests.post(url, data=request, headers={ 'Content-Type': 'application/x-www-form-urlencoded' }, verify=self._safe)
+		response = self._transport.post(url, data=request, headers={ 'Content-Type': 'application/x-www-form-urlencoded' }, verify=self._safe, timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return ManagerApiRequestContext(result['user_id'], result['access_token'], result['refresh_token'], result['access_token_exp'], result['token_type'], client_id)
 
@@ -61,7 +154,7 @@ class ManagerApi:
 			'client_id': client_id
 		}
 		url = join_url(self._api_root, 'oauth2', 'token')
-		response = requests.post(url, data=request, headers={ 'Content-Type': 'application/x-www-form-urlencoded' }, verify=self._safe)
+		response = self._transport.post(url, data=request, headers={ 'Content-Type': 'application/x-www-form-urlencoded' }, verify=self._safe, timeout=self._http_options.timeout)
 		result = self.process_response(response)
 		return ManagerApiRequestContext(result['user_id'], result['access_token'], result['refresh_token'], result['access_token_exp'], result['token_type'], client_id)
 
@@ -71,6 +164,10 @@ class ManagerApi:
 
 		criterion = None
 		if by_path is not None:
+			if self.cache is not None:
+				cached = self.cache.get_by_path(by_path)
+				if cached is not None:
+					return cached
 			criterion = { '$eq': { '$path': by_path } }
 
 		try:
@@ -84,11 +181,20 @@ class ManagerApi:
 		if resource_id is None:
 			raise ValueError('"resource_id"" expected.')
 
+		if self.cache is not None:
+			cached = self.cache.get(resource_id)
+			if cached is not None:
+				return cached
+
 		url = join_url(self._api_root, 'get-resource')
-		result = self.refresh_on_expiration(requests.get, auth_context, url, params={ 'resource-id': resource_id }, verify=self._safe)
+		result = self.refresh_on_expiration(self._transport.get, auth_context, url, params={ 'resource-id': resource_id }, verify=self._safe)
+		if self.cache is not None:
+			self.cache.put(result)
 		return result
 
-	def get_resources_by_criterion(self, auth_context, criterion, options=None):
+	def get_resources_by_criterion(self, auth_context, criterion, options=None, typed=False):
+		# typed: returns compact Resource objects instead of dicts (see resources.py), these aren't put into the cache.
+		# Listings are decoded by orjson, when it's installed.
 		if criterion is None:
 			raise ValueError('"criterion"" expected.')
 
@@ -98,10 +204,45 @@ class ManagerApi:
 			for key in options:
 				params[key] = options[key]
 
-		result = self.refresh_on_expiration(requests.post, auth_context, url, params=params, json=criterion, verify=self._safe)
+		content = self.refresh_on_expiration(self._transport.post, auth_context, url, responseJson=False, params=params, json=criterion, verify=self._safe)
+		result = loads(content) if content else None
 		assert isinstance(result, list), 'Result is not a list.'
+		if typed:
+			return ResourceDecoder().decode(result)
+		if self.cache is not None:
+			for resource in result:
+				self.cache.put(resource)
 		return result
 
+	def iter_resources_by_criterion(self, auth_context, criterion, sort_by='id', page_size=MAX_RESULT_LIMIT, prefetch=True, typed=False):
+		# Keyset pagination: every page continues after the last sort key of the previous page,
+		# so deep pages cost the same as the first one, and concurrent changes don't shift page borders.
+		# The sort key should be unique (like id or $path), equal keys on a page border would be skipped.
+		# The next page is fetched in the background while the caller consumes the current one.
+		if criterion is None:
+			raise ValueError('"criterion"" expected.')
+
+		def fetch(last_key, limit):
+			page_criterion = criterion if last_key is None else { '$and': [criterion, { '$gt': { sort_by: last_key } }] }
+			while True:
+				try:
+					return self.get_resources_by_criterion(auth_context, page_criterion, { 'sort-by': sort_by, 'limit': limit }, typed), limit
+				except BIMcloudManagerError as err:
+					# 17: ResultLimitExceededError
+					if err.code != 17 or limit <= 1:
+						raise
+					limit //= 2
+
+		with ThreadPoolExecutor(max_workers=1) as executor:
+			page, limit = fetch(None, min(page_size, MAX_RESULT_LIMIT))
+			while page:
+				has_next = len(page) >= limit
+				next_page = executor.submit(fetch, page[-1][sort_by], limit) if has_next and prefetch else None
+				yield from page
+				if not has_next:
+					return
+				page, limit = next_page.result() if next_page is not None else fetch(page[-1][sort_by], limit)
+
 	def get_resource_by_criterion(self, auth_context, criterion, options=None):
 		result = self.get_resources_by_criterion(auth_context, criterion, options)
 		return result[0] if result else None
@@ -112,31 +253,47 @@ class ManagerApi:
 			'name': name,
 			'type': 'resourceGroup'
 		}
-		result = self.refresh_on_expiration(requests.post, auth_context, url, params={ 'parent-id': parent_id }, json=directory, verify=self._safe)
+		result = self.refresh_on_expiration(self._transport.post, auth_context, url, params={ 'parent-id': parent_id }, json=directory, verify=self._safe)
 		assert isinstance(result, str), 'Result is not a string.'
+		if self.cache is not None and parent_id is not None:
+			self.cache.invalidate(parent_id)
 		return result
 
 	def delete_resource_group(self, auth_context, directory_id):
 		url = join_url(self._api_root, 'delete-resource-group')
-		result = self.refresh_on_expiration(requests.delete, auth_context, url, params={ 'resource-id': directory_id }, verify=self._safe)
+		result = self.refresh_on_expiration(self._transport.delete, auth_context, url, params={ 'resource-id': directory_id }, verify=self._safe)
+		if self.cache is not None:
+			self.cache.invalidate_subtree(directory_id)
 		return result
 
 	def delete_resources_by_id_list(self, auth_context, ids):
 		url = join_url(self._api_root, 'delete-resources-by-id-list')
-		result = self.refresh_on_expiration(requests.post, auth_context, url, json={ 'ids': ids }, verify=self._safe)
+		result = self.refresh_on_expiration(self._transport.post, auth_context, url, json={ 'ids': ids }, verify=self._safe)
+		if self.cache is not None:
+			# Reads before the job is done could put the resources back into the cache.
+			self.cache.invalidate_subtrees(ids)
+			if isinstance(result, dict) and result.get('status') not in FINAL_JOB_STATUSES:
+				with self._pending_deletes_lock:
+					self._pending_deletes[result['id']] = list(ids)
 		return result
 
 	def delete_blob(self, auth_context, blob_id):
 		url = join_url(self._api_root, 'delete-blob')
-		self.refresh_on_expiration(requests.delete, auth_context, url, params={'resource-id': blob_id }, verify=self._safe)
+		self.refresh_on_expiration(self._transport.delete, auth_context, url, params={'resource-id': blob_id }, verify=self._safe)
+		if self.cache is not None:
+			self.cache.invalidate(blob_id)
 
 	def update_blob(self, auth_context, blob):
 		url = join_url(self._api_root, 'update-blob')
-		self.refresh_on_expiration(requests.put, auth_context, url, json=blob, verify=self._safe)
+		self.refresh_on_expiration(self._transport.put, auth_context, url, json=blob, verify=self._safe)
+		if self.cache is not None:
+			self.cache.invalidate(blob['id'])
 
 	def update_blob_parent(self, auth_context, blob_id, body):
 		url = join_url(self._api_root, 'update-blob-parent')
-		self.refresh_on_expiration(requests.post, auth_context, url, params={ 'blob-id': blob_id }, json=body, verify=self._safe)
+		self.refresh_on_expiration(self._transport.post, auth_context, url, params={ 'blob-id': blob_id }, json=body, verify=self._safe)
+		if self.cache is not None:
+			self.cache.invalidate(blob_id)
 
 	def get_blob_changes_for_sync(self, auth_context, path, resource_group_id, from_revision):
 		url = join_url(self._api_root, 'get-blob-changes-for-sync')
@@ -145,23 +302,28 @@ class ManagerApi:
 			'resourceGroupId': resource_group_id,
 			'fromRevision': from_revision
 		}
-		result = self.refresh_on_expiration(requests.post, auth_context, url, json=request, verify=self._safe)
+		result = self.refresh_on_expiration(self._transport.post, auth_context, url, json=request, verify=self._safe)
 		assert isinstance(result, object), 'Result is not an object.'
 		return result
 
 	def get_inherited_default_blob_server_id(self, auth_context, resource_group_id):
 		url = join_url(self._api_root, 'get-inherited-default-blob-server-id')
-		result = self.refresh_on_expiration(requests.get, auth_context, url, params={ 'resource-group-id': resource_group_id }, verify=self._safe)
+		result = self.refresh_on_expiration(self._transport.get, auth_context, url, params={ 'resource-group-id': resource_group_id }, verify=self._safe)
 		return result
 
 	def get_job(self, auth_context, job_id):
 		url = join_url(self._api_root, 'get-job')
-		result = self.refresh_on_expiration(requests.get, auth_context, url, params={ 'job-id': job_id }, verify=self._safe)
+		result = self.refresh_on_expiration(self._transport.get, auth_context, url, params={ 'job-id': job_id }, verify=self._safe)
+		if isinstance(result, dict) and result.get('status') in FINAL_JOB_STATUSES:
+			with self._pending_deletes_lock:
+				deleted_ids = self._pending_deletes.pop(job_id, None)
+			if deleted_ids is not None and self.cache is not None:
+				self.cache.invalidate_subtrees(deleted_ids)
 		return result
 
 	def abort_job(self, auth_context, job_id):
-		url = join_url(self._api_root, 'get-job')
-		result = self.refresh_on_expiration(requests.post, auth_context, url, params={ 'job-id': job_id }, verify=self._safe)
+		url = join_url(self._api_root, 'abort-job')
+		result = self.refresh_on_expiration(self._transport.post, auth_context, url, params={ 'job-id': job_id }, verify=self._safe)
 		return result
 
 	def get_ticket(self, auth_context, resource_id):
@@ -171,27 +333,50 @@ class ManagerApi:
 			'resources': [resource_id],
 			'format': 'base64'
 		}
-		result = self.refresh_on_expiration(requests.post, auth_context, url, False, json=request, verify=self._safe)
+		result = self.refresh_on_expiration(self._transport.post, auth_context, url, False, json=request, verify=self._safe)
 		assert isinstance(result, bytes), 'Result is not a bytes.'
 		result = result.decode('utf-8')
 		return result
 
 	def get_user(self, auth_context, user_id):
 		url = join_url(self._api_root, 'get-user')
-		result = self.refresh_on_expiration(requests.get, auth_context, url, params={ 'user-id': user_id }, verify=self._safe)
+		result = self.refresh_on_expiration(self._transport.get, auth_context, url, params={ 'user-id': user_id }, verify=self._safe)
 		return result
 
+	def refresh_token(self, auth_context, stale_access_token=None):
+		# Single-flight: when many threads find the same token expired, only the first one sends a refresh grant,
+		# the others wait for it and go on with the new token.
+		with auth_context._refresh_lock:
+			if stale_access_token is not None and auth_context._access_token != stale_access_token:
+				return
+			start = time.perf_counter()
+			result = self.get_token_by_refresh_token_grant(auth_context._refresh_token, auth_context.client_id)
+			elapsed = time.perf_counter() - start
+			auth_context.update_tokens(result, elapsed)
+			if self._http_options.metrics is not None:
+				self._http_options.metrics.count_token_refresh(elapsed)
+
 	def refresh_on_expiration(self, req, auth_context, url, responseJson=True, **kwargs):
+		kwargs.setdefault('timeout', self._http_options.timeout)
+		access_token = auth_context._access_token
+		if auth_context.should_refresh(self._refresh_margin):
+			try:
+				self.refresh_token(auth_context, access_token)
+			except Exception:
+				# The token is refreshed in advance, while it's valid the request still goes with it (and a next one refreshes).
+				if auth_context.expires_within(0):
+					raise
+			access_token = auth_context._access_token
 		try:
-			response = req(url, **kwargs, headers={ 'Authorization': f'Bearer {auth_context._access_token}' })
+			response = req(url, **kwargs, headers={ 'Authorization': f'Bearer {access_token}' })
 			return self.process_response(response, json=responseJson)
 		except HttpError as e:
 			if e.status_code == 401:
 				errorJson = e.response.json()
 				if 'error' in errorJson and errorJson['error'] == 'invalid_token':
-					result = self.get_token_by_refresh_token_grant(auth_context._refresh_token, auth_context.client_id)
-					auth_context._access_token = result._access_token
-					auth_context._refresh_token = result._refresh_token
+					self.refresh_token(auth_context, access_token)
+					if self._http_options.metrics is not None:
+						self._http_options.metrics.count_retry(get_endpoint(url), 'invalid_token')
 					response = req(url, headers={ 'Authorization': f'Bearer {auth_context._access_token}' }, **kwargs)
 					return self.process_response(response, json=responseJson)
 			raise e
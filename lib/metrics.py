@@ -0,0 +1,235 @@
+import collections
+import contextlib
+import threading
+import time
+from .errors import get_manager_error_id, get_blob_server_error_id
+from .transport import get_request_size
+from .url import get_endpoint
+
+# Request duration histogram buckets in seconds.
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+	def __init__(self, buckets):
+		self.buckets = tuple(buckets)
+		# Cumulative counts are computed on export, these are per bucket, the last one is +Inf.
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		index = 0
+		while index < len(self.buckets) and value > self.buckets[index]:
+			index += 1
+		self.counts[index] += 1
+		self.sum += value
+		self.count += 1
+
+class Metrics:
+	# Request metrics of the API classes, shared by every instance that gets it through HttpSessionOptions(metrics=...).
+	# on_event(kind, values) is called for every recorded event: 'request', 'retry', 'token_refresh', 'error' and 'phase'.
+	def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS, on_event=None):
+		self._buckets = buckets
+		self._on_event = on_event
+		self._lock = threading.Lock()
+		self.latencies = {}
+		self.requests = collections.Counter()
+		self.bytes_sent = collections.Counter()
+		self.bytes_received = collections.Counter()
+		self.retries = collections.Counter()
+		self.errors = collections.Counter()
+		self.token_refreshes = 0
+		self.token_refresh_seconds = 0.0
+		self.phases = collections.OrderedDict()
+
+	@property
+	def middleware(self):
+		return MetricsMiddleware(self)
+
+	def observe_request(self, endpoint, method, status, seconds, sent, received):
+		with self._lock:
+			histogram = self.latencies.get((endpoint, method))
+			if histogram is None:
+				histogram = self.latencies[(endpoint, method)] = Histogram(self._buckets)
+			histogram.observe(seconds)
+			self.requests[(endpoint, method, str(status))] += 1
+			self.bytes_sent[endpoint] += sent
+			self.bytes_received[endpoint] += received
+		self._emit('request', endpoint=endpoint, method=method, status=status, seconds=seconds, sent=sent, received=received)
+
+	def count_received(self, endpoint, size):
+		# Streamed responses are counted as they are read.
+		with self._lock:
+			self.bytes_received[endpoint] += size
+
+	def count_retry(self, operation, reason):
+		with self._lock:
+			self.retries[(operation, reason)] += 1
+		self._emit('retry', operation=operation, reason=reason)
+
+	def count_token_refresh(self, seconds):
+		with self._lock:
+			self.token_refreshes += 1
+			self.token_refresh_seconds += seconds
+		self._emit('token_refresh', seconds=seconds)
+
+	def count_error(self, source, code):
+		# source: 'manager' or 'blob-server'
+		name = get_manager_error_id(code) if source == 'manager' else get_blob_server_error_id(code)
+		with self._lock:
+			self.errors[(source, code, name)] += 1
+		self._emit('error', source=source, code=code, name=name)
+
+	@contextlib.contextmanager
+	def phase(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			seconds = time.perf_counter() - start
+			with self._lock:
+				self.phases[name] = self.phases.get(name, 0.0) + seconds
+			self._emit('phase', name=name, seconds=seconds)
+
+	def snapshot(self):
+		with self._lock:
+			return {
+				'requests': [
+					{ 'endpoint': endpoint, 'method': method, 'count': histogram.count, 'seconds': histogram.sum }
+					for (endpoint, method), histogram in self.latencies.items()
+				],
+				'statuses': [{ 'endpoint': endpoint, 'method': method, 'status': status, 'count': count } for (endpoint, method, status), count in self.requests.items()],
+				'bytesSent': dict(self.bytes_sent),
+				'bytesReceived': dict(self.bytes_received),
+				'retries': [{ 'operation': operation, 'reason': reason, 'count': count } for (operation, reason), count in self.retries.items()],
+				'errors': [{ 'source': source, 'code': code, 'name': name, 'count': count } for (source, code, name), count in self.errors.items()],
+				'tokenRefreshes': self.token_refreshes,
+				'tokenRefreshSeconds': self.token_refresh_seconds,
+				'phases': dict(self.phases)
+			}
+
+	def to_prometheus(self):
+		# Text exposition format.
+		lines = []
+		def family(name, metric_type, help_text):
+			lines.append(f'# HELP {name} {help_text}')
+			lines.append(f'# TYPE {name} {metric_type}')
+
+		with self._lock:
+			family('bimcloud_request_duration_seconds', 'histogram', 'Time until response headers, by endpoint.')
+			for (endpoint, method), histogram in sorted(self.latencies.items()):
+				labels = { 'endpoint': endpoint, 'method': method }
+				cumulative = 0
+				for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+					cumulative += count
+					lines.append(f'bimcloud_request_duration_seconds_bucket{format_labels(labels, le=format_bound(bound))} {cumulative}')
+				lines.append(f'bimcloud_request_duration_seconds_sum{format_labels(labels)} {histogram.sum}')
+				lines.append(f'bimcloud_request_duration_seconds_count{format_labels(labels)} {histogram.count}')
+
+			family('bimcloud_requests_total', 'counter', 'Requests by endpoint and response status.')
+			for (endpoint, method, status), count in sorted(self.requests.items()):
+				lines.append(f'bimcloud_requests_total{format_labels({ "endpoint": endpoint, "method": method, "status": status })} {count}')
+
+			family('bimcloud_sent_bytes_total', 'counter', 'Request body bytes by endpoint.')
+			for endpoint, count in sorted(self.bytes_sent.items()):
+				lines.append(f'bimcloud_sent_bytes_total{format_labels({ "endpoint": endpoint })} {count}')
+
+			family('bimcloud_received_bytes_total', 'counter', 'Response body bytes by endpoint.')
+			for endpoint, count in sorted(self.bytes_received.items()):
+				lines.append(f'bimcloud_received_bytes_total{format_labels({ "endpoint": endpoint })} {count}')
+
+			family('bimcloud_retries_total', 'counter', 'Retried operations by reason.')
+			for (operation, reason), count in sorted(self.retries.items()):
+				lines.append(f'bimcloud_retries_total{format_labels({ "operation": operation, "reason": reason })} {count}')
+
+			family('bimcloud_errors_total', 'counter', 'BIMcloud errors by source and error code.')
+			for (source, code, name), count in sorted(self.errors.items(), key=lambda item: (item[0][0], item[0][1])):
+				lines.append(f'bimcloud_errors_total{format_labels({ "source": source, "code": str(code), "name": name or "" })} {count}')
+
+			family('bimcloud_token_refreshes_total', 'counter', 'Access token refreshes.')
+			lines.append(f'bimcloud_token_refreshes_total {self.token_refreshes}')
+			family('bimcloud_token_refresh_seconds_total', 'counter', 'Time spent on access token refreshes.')
+			lines.append(f'bimcloud_token_refresh_seconds_total {self.token_refresh_seconds}')
+
+			family('bimcloud_phase_seconds_total', 'counter', 'Time spent in workflow phases.')
+			for name, seconds in self.phases.items():
+				lines.append(f'bimcloud_phase_seconds_total{format_labels({ "phase": name })} {seconds}')
+		return '\n'.join(lines) + '\n'
+
+	def _emit(self, kind, **values):
+		if self._on_event is None:
+			return
+		try:
+			self._on_event(kind, values)
+		except Exception:
+			pass # Callbacks shouldn't break requests.
+
+def format_bound(bound):
+	return '+Inf' if bound == float('inf') else repr(float(bound))
+
+def escape_label_value(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels, **extra):
+	items = list(labels.items()) + list(extra.items())
+	return '{' + ','.join(f'{key}="{escape_label_value(value)}"' for key, value in items) + '}'
+
+class MetricsMiddleware:
+	# Transport middleware recording every request into Metrics (see Transport in transport.py).
+	def __init__(self, metrics):
+		self._metrics = metrics
+
+	def __call__(self, request, send):
+		endpoint = get_endpoint(request.url)
+		sent = get_request_size(request)
+		start = time.perf_counter()
+		try:
+			response = send(request)
+		except Exception as err:
+			self._metrics.observe_request(endpoint, request.method, type(err).__name__, time.perf_counter() - start, sent, 0)
+			raise
+		seconds = time.perf_counter() - start
+
+		if response.status_code == 430:
+			try:
+				content = response.json()
+				if '/management/' in request.url:
+					self._metrics.count_error('manager', content['error-code'])
+				else:
+					self._metrics.count_error('blob-server', content['data']['error-code'])
+			except Exception:
+				pass # Malformed error responses are reported as HttpError anyway.
+
+		if request.kwargs.get('stream') and response.ok:
+			received = 0
+			response.raw = _CountingStream(response.raw, self._metrics, endpoint)
+		else:
+			received = len(response.content or b'')
+		self._metrics.observe_request(endpoint, request.method, response.status_code, seconds, sent, received)
+		return response
+
+class _CountingStream:
+	def __init__(self, raw, metrics, endpoint):
+		self._raw = raw
+		self._metrics = metrics
+		self._endpoint = endpoint
+
+	def read(self, *args, **kwargs):
+		data = self._raw.read(*args, **kwargs)
+		if data:
+			self._metrics.count_received(self._endpoint, len(data))
+		return data
+
+	def readinto(self, buffer):
+		size = self._raw.readinto(buffer)
+		if size:
+			self._metrics.count_received(self._endpoint, size)
+		return size
+
+	def stream(self, amt=2 ** 16, decode_content=None):
+		for data in self._raw.stream(amt, decode_content=decode_content):
+			self._metrics.count_received(self._endpoint, len(data))
+			yield data
+
+	def __getattr__(self, name):
+		return getattr(self._raw, name)
@@ -0,0 +1,175 @@
+import os
+import sqlite3
+from .errors import BIMcloudManagerError, BIMcloudBlobServerError
+
+INDEX_FILE_NAME = '.bimcloud-mirror.sqlite'
+
+class Mirror:
+	# Materializes a server directory into a local folder, and keeps it up to date
+	# by applying get-blob-changes-for-sync deltas.
+	# The revision cursor and a path/id/hash index of the local copies are persisted in a SQLite file,
+	# so a restarted process continues where the previous one stopped.
+	def __init__(self, manager_api, auth_context, run_with_blob_server_session, server_path, local_dir, index_path=None):
+		self._manager_api = manager_api
+		self._auth_context = auth_context
+		self._run_with_blob_server_session = run_with_blob_server_session
+		self._server_path = server_path.rstrip('/')
+		self._local_dir = local_dir
+		self._model_servers = {}
+
+		os.makedirs(local_dir, exist_ok=True)
+		self._db = sqlite3.connect(index_path or os.path.join(local_dir, INDEX_FILE_NAME))
+		with self._db:
+			self._db.execute('CREATE TABLE IF NOT EXISTS blobs (id TEXT PRIMARY KEY, path TEXT NOT NULL, revision INTEGER, timestamp REAL, content_hash TEXT)')
+			self._db.execute('CREATE INDEX IF NOT EXISTS blobs_path ON blobs (path)')
+			self._db.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+		stored_server_path = self._get_state('server_path')
+		if stored_server_path is not None and stored_server_path != self._server_path:
+			raise ValueError(f'Index belongs to a mirror of "{stored_server_path}".')
+
+	@property
+	def revision(self):
+		value = self._get_state('revision')
+		return int(value) if value is not None else 0
+
+	def close(self):
+		self._db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def sync(self):
+		# Applies the next changeset, returns True if there was any.
+		from_revision = self.revision
+		try:
+			changes = self._manager_api.get_blob_changes_for_sync(self._auth_context, self._server_path, None, from_revision)
+		except BIMcloudManagerError as err:
+			if err.code != 9:
+				raise
+			# Revision Obsoleted: the server side database has been replaced (eg. by restoring a backup).
+			# The revision 0 changeset describes the whole content, which gets diffed against the index.
+			from_revision = 0
+			changes = self._manager_api.get_blob_changes_for_sync(self._auth_context, self._server_path, None, from_revision)
+
+		if from_revision == 0:
+			self._apply_snapshot(changes.get('created', []))
+		else:
+			deleted = changes.get('deleted', [])
+			for item in deleted:
+				self._delete(item['path'])
+			# Blobs created or updated, and deleted within the same changeset are not there anymore.
+			deleted_ids = set(item['id'] for item in deleted)
+			for item in changes.get('created', []) + changes.get('updated', []):
+				if item['id'] not in deleted_ids:
+					self._download(item)
+
+		end_revision = changes['endRevision']
+		with self._db:
+			self._set_state('server_path', self._server_path)
+			self._set_state('revision', str(end_revision))
+		return end_revision != from_revision
+
+	def _apply_snapshot(self, created):
+		# Blobs which are already there with the same path and timestamp are kept, the rest is downloaded or deleted.
+		indexed = { row[0]: (row[1], row[2]) for row in self._db.execute('SELECT id, path, timestamp FROM blobs') }
+		created_ids = set()
+		for item in created:
+			created_ids.add(item['id'])
+			if indexed.get(item['id']) == (item['path'], item.get('timestamp')) and os.path.isfile(self._to_local_path(item['path'])):
+				continue
+			self._download(item)
+		for blob_id, (path, _) in indexed.items():
+			if blob_id not in created_ids:
+				self._delete(path)
+
+	def _download(self, item):
+		blob_id = item['id']
+		path = item['path']
+		local_path = self._to_local_path(path)
+		os.makedirs(os.path.dirname(local_path), exist_ok=True)
+
+		# The blob could have been deleted since the changeset was made, that is handled as its delete,
+		# so the changeset still gets applied and the revision cursor moves on.
+		# Changeset items could carry the Model Server of the blob, the resource is only fetched without it.
+		model_server_id = item.get('modelServerId')
+		if model_server_id is None:
+			try:
+				model_server_id = self._manager_api.get_resource_by_id(self._auth_context, blob_id)['modelServerId']
+			except BIMcloudManagerError as err:
+				# EntityNotFoundError
+				if err.code != 6:
+					raise
+				self._forget(blob_id, local_path)
+				return
+		model_server = self._get_model_server(model_server_id)
+		try:
+			_, content_hash = self._run_with_blob_server_session(model_server, lambda session_id, api: api.download_blob_to(session_id, blob_id, local_path))
+		except BIMcloudBlobServerError as err:
+			# BlobNotFound
+			if err.code != 21:
+				raise
+			self._forget(blob_id, local_path)
+			return
+
+		# Moved or renamed blobs leave their previous local copy behind:
+		previous = self._db.execute('SELECT path FROM blobs WHERE id = ?', (blob_id,)).fetchone()
+		if previous is not None and previous[0] != path:
+			self._remove_local_file(previous[0])
+
+		with self._db:
+			self._db.execute('INSERT OR REPLACE INTO blobs (id, path, revision, timestamp, content_hash) VALUES (?, ?, ?, ?, ?)',
+				(blob_id, path, item.get('revision'), item.get('timestamp'), content_hash))
+
+	def _delete(self, path):
+		# Deleted items could be directories, their whole indexed subtree gets removed.
+		prefix = path.rstrip('/') + '/'
+		rows = self._db.execute('SELECT path FROM blobs WHERE path = ? OR substr(path, 1, ?) = ?', (path, len(prefix), prefix)).fetchall()
+		for row in rows:
+			self._remove_local_file(row[0])
+		with self._db:
+			self._db.execute('DELETE FROM blobs WHERE path = ? OR substr(path, 1, ?) = ?', (path, len(prefix), prefix))
+
+	def _forget(self, blob_id, local_path):
+		# Removes the local copy of a blob which is not on the server anymore.
+		previous = self._db.execute('SELECT path FROM blobs WHERE id = ?', (blob_id,)).fetchone()
+		if previous is not None:
+			self._remove_local_file(previous[0])
+			with self._db:
+				self._db.execute('DELETE FROM blobs WHERE id = ?', (blob_id,))
+		self._prune_empty_dirs(os.path.dirname(local_path))
+
+	def _remove_local_file(self, path):
+		local_path = self._to_local_path(path)
+		if os.path.isfile(local_path):
+			os.remove(local_path)
+		self._prune_empty_dirs(os.path.dirname(local_path))
+
+	def _prune_empty_dirs(self, local_dir):
+		while os.path.abspath(local_dir) != os.path.abspath(self._local_dir) and os.path.isdir(local_dir) and not os.listdir(local_dir):
+			os.rmdir(local_dir)
+			local_dir = os.path.dirname(local_dir)
+
+	def _get_model_server(self, model_server_id):
+		model_server = self._model_servers.get(model_server_id)
+		if model_server is None:
+			model_server = self._manager_api.get_resource_by_id(self._auth_context, model_server_id)
+			self._model_servers[model_server_id] = model_server
+		return model_server
+
+	def _to_local_path(self, path):
+		if not path.startswith(self._server_path + '/'):
+			raise ValueError(f'"{path}" is not under "{self._server_path}".')
+		parts = path[len(self._server_path) + 1:].split('/')
+		if any(part in ('', '.', '..') for part in parts):
+			raise ValueError(f'"{path}" cannot be mapped to a local path.')
+		return os.path.join(self._local_dir, *parts)
+
+	def _get_state(self, key):
+		row = self._db.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+		return row[0] if row is not None else None
+
+	def _set_state(self, key, value):
+		self._db.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, value))
@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .url import join_url, parse_url
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.bimcloud-api', 'model-server-urls.json')
+
+class ModelServerUrlSelector:
+	# There could be many Model Server urls configured, to be accessible from different network locations.
+	# Candidates are probed concurrently with short timeouts and ranked by latency.
+	# Rankings are kept in memory, and optionally on disk until they expire, so new processes skip the probing.
+	def __init__(self, manager_url, cache_path=None, ttl=3600, probe_timeout=3, max_workers=8, session=None):
+		parsed_manager_url = parse_url(manager_url)
+		self._manager_hostname = parsed_manager_url.hostname
+		self._manager_protocol = parsed_manager_url.scheme + ':'
+		self._cache_path = cache_path
+		self._ttl = ttl
+		self._probe_timeout = probe_timeout
+		self._max_workers = max_workers
+		self._session = session if session is not None else requests.Session()
+		self._lock = threading.Lock()
+		self._rankings = self._load()
+
+	def get_candidate_urls(self, model_server):
+		possible_urls = model_server['connectionUrls']
+		assert isinstance(possible_urls, list), '"possible_urls" is not a list.'
+		return [url.replace('$protocol', self._manager_protocol).replace('$hostname', self._manager_hostname) for url in possible_urls]
+
+	def probe(self, url):
+		# Returns the round-trip time in seconds, or None if the url is unusable.
+		try:
+			start = time.perf_counter()
+			response = self._session.get(join_url(url, 'application-server-service/get-runtime-id'), timeout=self._probe_timeout)
+			if response.ok:
+				return time.perf_counter() - start
+		except requests.RequestException:
+			pass
+		return None
+
+	def rank(self, model_server, refresh=False):
+		candidates = self.get_candidate_urls(model_server)
+		with self._lock:
+			ranking = self._rankings.get(model_server['id'])
+			if not refresh and ranking is not None and ranking['candidates'] == candidates and ranking['expires'] > time.time() and ranking['urls']:
+				return list(ranking['urls'])
+
+		with ThreadPoolExecutor(max_workers=min(self._max_workers, max(1, len(candidates)))) as executor:
+			latencies = list(executor.map(self.probe, candidates))
+		# Original order breaks ties, urls on top are most likely accessible.
+		ranked = sorted((latency, index, url) for index, (url, latency) in enumerate(zip(candidates, latencies)) if latency is not None)
+		urls = [url for _, _, url in ranked]
+
+		with self._lock:
+			self._rankings[model_server['id']] = {
+				'candidates': candidates,
+				'urls': urls,
+				'latencies': [latency for latency, _, _ in ranked],
+				'expires': time.time() + self._ttl
+			}
+			self._save()
+		return list(urls)
+
+	def select(self, model_server):
+		urls = self.rank(model_server)
+		if not urls:
+			model_server_name = model_server['name']
+			raise RuntimeError(f'Model Server "{model_server_name}" is unreachable.')
+		return urls[0]
+
+	def failover(self, model_server, failed_url):
+		# Drops a url that failed mid-session, and returns the next best one.
+		# When no ranked urls are left, candidates get probed again.
+		with self._lock:
+			ranking = self._rankings.get(model_server['id'])
+			if ranking is not None and failed_url in ranking['urls']:
+				index = ranking['urls'].index(failed_url)
+				del ranking['urls'][index]
+				del ranking['latencies'][index]
+				self._save()
+			has_urls = ranking is not None and bool(ranking['urls'])
+		if not has_urls:
+			self.rank(model_server, refresh=True)
+		return self.select(model_server)
+
+	def _load(self):
+		if self._cache_path is None or not os.path.isfile(self._cache_path):
+			return {}
+		try:
+			with open(self._cache_path, 'r', encoding='utf-8') as f:
+				rankings = json.load(f)
+		except (OSError, ValueError):
+			return {}
+		now = time.time()
+		return { key: value for key, value in rankings.items() if isinstance(value, dict) and value.get('expires', 0) > now }
+
+	def _save(self):
+		if self._cache_path is None:
+			return
+		cache_dir = os.path.dirname(os.path.abspath(self._cache_path))
+		os.makedirs(cache_dir, exist_ok=True)
+		fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'w', encoding='utf-8') as f:
+				json.dump(self._rankings, f)
+			os.replace(temp_path, self._cache_path)
+		except:
+			os.remove(temp_path)
+			raise
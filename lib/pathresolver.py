@@ -0,0 +1,47 @@
+def get_ancestor_paths(path):
+	# 'Project Root/a/b' -> ['Project Root', 'Project Root/a', 'Project Root/a/b']
+	parts = path.strip('/').split('/')
+	return ['/'.join(parts[:i + 1]) for i in range(len(parts))]
+
+class PathResolver:
+	# Finds the deepest existing directories of arbitrary paths,
+	# by querying every ancestor path at once instead of one level at a time.
+	def __init__(self, manager_api, auth_context, max_paths_per_query=100):
+		self._manager_api = manager_api
+		self._auth_context = auth_context
+		self._max_paths_per_query = max_paths_per_query
+
+	def find_immediate_parent_dir(self, path):
+		return self.find_immediate_parent_dirs([path])[path]
+
+	def find_immediate_parent_dirs(self, paths):
+		ancestor_paths = set()
+		for path in paths:
+			ancestor_paths.update(get_ancestor_paths(path))
+
+		existing_dirs = self.get_dirs_by_paths(sorted(ancestor_paths))
+
+		result = {}
+		for path in paths:
+			for ancestor_path in reversed(get_ancestor_paths(path)):
+				directory = existing_dirs.get(ancestor_path.lower())
+				if directory is not None:
+					result[path] = directory
+					break
+			else:
+				raise ValueError(f'No existing directory found on path "{path}".')
+		return result
+
+	def get_dirs_by_paths(self, paths):
+		# Returns existing directories by their lowercase paths, as paths are case insensitive on the server.
+		result = {}
+		for i in range(0, len(paths), self._max_paths_per_query):
+			criterion = {
+				'$and': [
+					{ '$eq': { 'type': 'resourceGroup' } },
+					{ '$or': [{ '$eq': { '$path': path } } for path in paths[i:i + self._max_paths_per_query]] }
+				]
+			}
+			for directory in self._manager_api.get_resources_by_criterion(self._auth_context, criterion):
+				result[directory['$path'].lower()] = directory
+		return result
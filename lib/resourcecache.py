@@ -0,0 +1,129 @@
+import collections
+import copy
+import threading
+import time
+
+DEFAULT_TTLS = {
+	'blob': 30,
+	'resourceGroup': 60,
+	'modelServer': 300
+}
+
+class ResourceCache:
+	# LRU cache of Manager resources by id, with a secondary path index.
+	# Entries expire by per-type TTLs (seconds), mutating ManagerApi calls invalidate the affected entries.
+	# Resources are copied in and out, so callers changing their results don't change the cache.
+	def __init__(self, max_size=10000, ttls=None, default_ttl=60, clock=time.monotonic):
+		self._max_size = max_size
+		self._ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+		self._default_ttl = default_ttl
+		self._clock = clock
+		self._entries = collections.OrderedDict()
+		self._ids_by_path = {}
+		self._lock = threading.RLock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+	@property
+	def stats(self):
+		with self._lock:
+			return {
+				'size': len(self._entries),
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'invalidations': self.invalidations
+			}
+
+	def get(self, resource_id):
+		with self._lock:
+			entry = self._entries.get(resource_id)
+			if entry is None:
+				self.misses += 1
+				return None
+			resource, expires = entry
+			if expires <= self._clock():
+				self._remove(resource_id)
+				self.misses += 1
+				return None
+			self._entries.move_to_end(resource_id)
+			self.hits += 1
+		return copy.deepcopy(resource)
+
+	def get_by_path(self, path):
+		with self._lock:
+			resource_id = self._ids_by_path.get(path.lower())
+			if resource_id is None:
+				self.misses += 1
+				return None
+			return self.get(resource_id)
+
+	def put(self, resource):
+		if not isinstance(resource, dict) or 'id' not in resource:
+			return
+		ttl = self._ttls.get(resource.get('type'), self._default_ttl)
+		if ttl <= 0:
+			return
+		resource = copy.deepcopy(resource)
+		with self._lock:
+			resource_id = resource['id']
+			self._remove(resource_id)
+			self._entries[resource_id] = (resource, self._clock() + ttl)
+			path = resource.get('$path')
+			if path is not None:
+				self._ids_by_path[path.lower()] = resource_id
+			while len(self._entries) > self._max_size:
+				self._remove(next(iter(self._entries)))
+				self.evictions += 1
+
+	def invalidate(self, resource_id):
+		with self._lock:
+			if self._remove(resource_id):
+				self.invalidations += 1
+
+	def invalidate_path(self, path):
+		with self._lock:
+			resource_id = self._ids_by_path.get(path.lower())
+			if resource_id is not None:
+				self.invalidate(resource_id)
+
+	def invalidate_subtree(self, resource_id):
+		# Drops a resource with all of its cached descendants, by ancestry or by path prefix.
+		self.invalidate_subtrees([resource_id])
+
+	def invalidate_subtrees(self, resource_ids):
+		# Same as invalidate_subtree for many resources, with a single pass over the cache.
+		ids = set(resource_ids)
+		if not ids:
+			return
+		with self._lock:
+			prefixes = tuple(
+				entry[0]['$path'].lower().rstrip('/') + '/'
+				for entry in (self._entries.get(resource_id) for resource_id in ids)
+				if entry is not None and entry[0].get('$path') is not None
+			)
+			descendant_ids = [
+				key for key, (resource, _) in self._entries.items()
+				if any(ancestor.get('id') in ids for ancestor in resource.get('$ancestors') or [])
+				or (prefixes and (resource.get('$path') or '').lower().startswith(prefixes))
+			]
+			for key in descendant_ids:
+				self.invalidate(key)
+			for resource_id in ids:
+				self.invalidate(resource_id)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._ids_by_path.clear()
+
+	def _remove(self, resource_id):
+		entry = self._entries.pop(resource_id, None)
+		if entry is None:
+			return False
+		path = entry[0].get('$path')
+		if path is not None and self._ids_by_path.get(path.lower()) == resource_id:
+			del self._ids_by_path[path.lower()]
+		return True
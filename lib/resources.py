@@ -0,0 +1,150 @@
+import json
+import sys
+from collections.abc import Mapping
+
+try:
+	import orjson
+except ImportError:
+	orjson = None # Optional, the json module of the standard library is used without it.
+
+def loads(content):
+	return orjson.loads(content) if orjson is not None else json.loads(content)
+
+def dumps(value):
+	return orjson.dumps(value) if orjson is not None else json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+def intern(value):
+	return sys.intern(value) if type(value) is str else value
+
+class Resource(Mapping):
+	# Compact read-only Manager resource (see ManagerApi.get_resources_by_criterion(typed=True)).
+	# It's a Mapping, so resource['$path'] or resource.get('modelServerId') work the same as with the decoded dicts.
+	# Frequent fields are slots, repeated strings are interned, $loweredPath is derived from $path,
+	# and the other fields are kept encoded until they are read. Equal $ancestors and encoded fields are shared (see ResourceDecoder).
+	__slots__ = ('id', 'type', 'name', 'path', 'parent_id', '_nulls', '_ancestors', '_lowered_path', '_extra')
+	# Field name: slot
+	FIELDS = { 'id': 'id', 'type': 'type', 'name': 'name', '$path': 'path', '$parentId': 'parent_id' }
+	# Not kept as they are.
+	DERIVED = ('$ancestors', '$loweredPath')
+
+	def __init__(self, values, decoder=None):
+		if decoder is None:
+			decoder = ResourceDecoder()
+		# Slots of missing fields are None, the fields which are there with null value are listed in _nulls (eg. $parentId of the root).
+		get = values.get
+		self._nulls = tuple(key for key, value in values.items() if value is None and key in self.FIELDS) if None in values.values() else ()
+		self.id = get('id')
+		self.type = intern(get('type'))
+		self.name = get('name')
+		self.path = get('$path')
+		self.parent_id = intern(get('$parentId'))
+		ancestors = get('$ancestors')
+		self._ancestors = decoder.share_ancestors(self.parent_id, ancestors) if ancestors is not None else None
+		self._lowered_path = get('$loweredPath') is not None
+		extra = { key: value for key, value in values.items() if key not in self.FIELDS and key not in Resource.DERIVED }
+		self._extra = decoder.share_encoded(extra) if extra else None
+
+	def __getitem__(self, key):
+		slot = self.FIELDS.get(key)
+		if slot is not None:
+			value = getattr(self, slot)
+			if value is None and key not in self._nulls:
+				raise KeyError(key)
+			return value
+		if key == '$ancestors' and self._ancestors is not None:
+			return [{ 'id': ancestor_id, 'name': name } for ancestor_id, name in self._ancestors]
+		if key == '$loweredPath' and self._lowered_path:
+			return self.path.lower()
+		if self._extra is not None:
+			extra = loads(self._extra)
+			if key in extra:
+				return extra[key]
+		raise KeyError(key)
+
+	def __iter__(self):
+		return iter(self.to_dict())
+
+	def __len__(self):
+		return len(self.to_dict())
+
+	def items(self):
+		return self.to_dict().items()
+
+	def values(self):
+		return self.to_dict().values()
+
+	def to_dict(self):
+		# The encoded fields are decoded once for all keys.
+		result = {}
+		for key, slot in self.FIELDS.items():
+			value = getattr(self, slot)
+			if value is not None or key in self._nulls:
+				result[key] = value
+		if self._ancestors is not None:
+			result['$ancestors'] = [{ 'id': ancestor_id, 'name': name } for ancestor_id, name in self._ancestors]
+		if self._lowered_path:
+			result['$loweredPath'] = self.path.lower()
+		if self._extra is not None:
+			result.update(loads(self._extra))
+		return result
+
+	def __repr__(self):
+		return f'{type(self).__name__}({self.to_dict()!r})'
+
+class ResourceGroup(Resource):
+	__slots__ = ()
+
+class Blob(Resource):
+	__slots__ = ('model_server_id', 'modified_date', 'size')
+	FIELDS = dict(Resource.FIELDS, **{ 'modelServerId': 'model_server_id', '$modifiedDate': 'modified_date', '$size': 'size' })
+
+	def __init__(self, values, decoder=None):
+		super().__init__(values, decoder)
+		get = values.get
+		self.model_server_id = intern(get('modelServerId'))
+		self.modified_date = get('$modifiedDate')
+		self.size = get('$size')
+
+class ModelServer(Resource):
+	__slots__ = ('connection_urls',)
+	FIELDS = dict(Resource.FIELDS, connectionUrls='connection_urls')
+
+	def __init__(self, values, decoder=None):
+		super().__init__(values, decoder)
+		self.connection_urls = values.get('connectionUrls')
+
+RESOURCE_TYPES = {
+	'resourceGroup': ResourceGroup,
+	'blob': Blob,
+	'modelServer': ModelServer
+}
+
+class ResourceDecoder:
+	# Creates the typed resources of a single listing. Resources of the same directory get the same $ancestors,
+	# and resources with equal other fields (like $parentName or $modelServerName) share their encoded copy.
+	def __init__(self):
+		self._ancestors = {}
+		self._encoded = {}
+
+	def decode(self, items):
+		return [self.create(values) for values in items]
+
+	def create(self, values):
+		return RESOURCE_TYPES.get(values.get('type'), Resource)(values, self)
+
+	def share_ancestors(self, parent_id, ancestors):
+		shared = self._ancestors.get(parent_id)
+		if shared is None:
+			shared = tuple((sys.intern(ancestor['id']), sys.intern(ancestor['name'])) for ancestor in ancestors)
+			if parent_id is not None:
+				self._ancestors[parent_id] = shared
+		return shared
+
+	def share_encoded(self, values):
+		encoded = dumps(values)
+		shared = self._encoded.get(encoded)
+		if shared is None:
+			# orjson over-allocates its output, the kept copy is exact-sized.
+			shared = bytes(memoryview(encoded))
+			self._encoded[shared] = shared
+		return shared
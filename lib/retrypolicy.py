@@ -0,0 +1,133 @@
+import email.utils
+import random
+import threading
+import time
+import requests
+from urllib3.exceptions import NewConnectionError
+from .url import get_endpoint
+
+# Requests which could be sent again even if the server has processed the previous attempt.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# PUT and DELETE are left out: a replayed update-blob fails with OptimisticLockError,
+# and a replayed delete fails with EntityNotFound, when the first attempt was done after all.
+# Endpoints which are safe to send again are listed here instead, whatever their method is.
+IDEMPOTENT_ENDPOINTS = (
+	'get-resources-by-criterion',
+	'get-blob-changes-for-sync',
+	'get-ticket'
+)
+# Endpoints which have their own retries, these requests are sent only once by the policy.
+# Parts are retried by the upload engine of BlobServerApi (see upload_blob_content), which shrinks the chunk size after every timeout.
+UNRETRIED_ENDPOINTS = ('put-blob-content-part',)
+
+# 503: Server unavailable, retry the request later. It's not processed, so it's safe to send anything again.
+SAFE_RETRY_STATUSES = (429, 503)
+# Gateway errors could come after the server has processed the request.
+IDEMPOTENT_RETRY_STATUSES = (502, 504)
+
+class RetryPolicy:
+	# Transport middleware sending failed requests again with exponential backoff (see Transport in transport.py).
+	# Requests which never reached the server (connection refused, 503) are retried regardless of their kind,
+	# others (timeouts, resets, gateway errors) only if they're idempotent, so commits are never replayed after they could have been done.
+	# Retries are limited by a budget shared by every request of the policy: each request earns budget_ratio retries,
+	# up to max_budget, so an outage doesn't multiply the load by max_attempts.
+	def __init__(self, max_attempts=4, base_delay=0.5, max_delay=30, jitter=0.5, max_retry_after=120, budget_ratio=0.2, max_budget=10, idempotent_endpoints=IDEMPOTENT_ENDPOINTS, unretried_endpoints=UNRETRIED_ENDPOINTS, sleep=time.sleep):
+		self.max_attempts = max_attempts
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.jitter = jitter
+		self.max_retry_after = max_retry_after
+		self.budget_ratio = budget_ratio
+		self.max_budget = max_budget
+		self.idempotent_endpoints = tuple(idempotent_endpoints)
+		self.unretried_endpoints = tuple(unretried_endpoints)
+		self._sleep = sleep
+		self._lock = threading.Lock()
+		self._random = random.Random()
+		self._budget = max_budget
+		self.metrics = None
+
+	def bind(self, metrics):
+		# Retries are counted into the metrics of the options the policy is used with.
+		self.metrics = metrics
+		return self
+
+	def __call__(self, request, send):
+		if get_endpoint(request.url).split('/')[-1] in self.unretried_endpoints:
+			return send(request)
+		self._earn()
+		attempt = 1
+		while True:
+			try:
+				response = send(request)
+			except requests.RequestException as err:
+				if not self._should_retry(request, attempt, self.is_retryable_error(request, err)):
+					raise
+				self._retry(request, attempt, type(err).__name__, None)
+				attempt += 1
+				continue
+
+			if not self._should_retry(request, attempt, self.is_retryable_status(request, response.status_code)):
+				return response
+			retry_after = RetryPolicy.parse_retry_after(response.headers.get('Retry-After'))
+			response.close()
+			self._retry(request, attempt, str(response.status_code), retry_after)
+			attempt += 1
+
+	def is_idempotent(self, request):
+		return request.method.upper() in IDEMPOTENT_METHODS or get_endpoint(request.url).split('/')[-1] in self.idempotent_endpoints
+
+	def is_retryable_status(self, request, status_code):
+		return status_code in SAFE_RETRY_STATUSES or (status_code in IDEMPOTENT_RETRY_STATUSES and self.is_idempotent(request))
+
+	def is_retryable_error(self, request, err):
+		if RetryPolicy.is_connect_error(err):
+			return True
+		return isinstance(err, (requests.ConnectionError, requests.Timeout)) and self.is_idempotent(request)
+
+	def get_delay(self, attempt, retry_after=None):
+		delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+		with self._lock:
+			delay *= self._random.uniform(1 - self.jitter, 1)
+		if retry_after is not None:
+			delay = max(delay, min(retry_after, self.max_retry_after))
+		return delay
+
+	def _should_retry(self, request, attempt, retryable):
+		if not retryable or attempt >= self.max_attempts:
+			return False
+		with self._lock:
+			if self._budget < 1:
+				return False
+			self._budget -= 1
+		return True
+
+	def _earn(self):
+		with self._lock:
+			self._budget = min(self.max_budget, self._budget + self.budget_ratio)
+
+	def _retry(self, request, attempt, reason, retry_after):
+		if self.metrics is not None:
+			self.metrics.count_retry(get_endpoint(request.url), reason)
+		self._sleep(self.get_delay(attempt, retry_after))
+
+	@staticmethod
+	def is_connect_error(err):
+		# The request couldn't have reached the server.
+		if isinstance(err, requests.ConnectTimeout):
+			return True
+		return isinstance(err, requests.ConnectionError) and bool(err.args) and isinstance(getattr(err.args[0], 'reason', None), NewConnectionError)
+
+	@staticmethod
+	def parse_retry_after(value):
+		# Retry-After is either seconds or an HTTP date.
+		if not value:
+			return None
+		try:
+			return max(0.0, float(value))
+		except ValueError:
+			pass
+		try:
+			return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+		except (TypeError, ValueError):
+			return None
@@ -0,0 +1,104 @@
+import random
+import re
+import threading
+import time
+import requests
+from .transport import create_response, get_request_size
+
+class ShapingMiddleware:
+	# Transport middleware imitating slow or unreliable networks and servers (see Transport in transport.py):
+	# latency: seconds added to every request, jitter: random extra seconds up to this,
+	# bandwidth: bytes per second in each direction, None is unlimited,
+	# unavailable_rate: chance of a "503 Service Unavailable" response (retry_after: its Retry-After header),
+	# reset_rate: chance of a connection reset, before the request is sent or after the server has processed it (reset_after_send),
+	# error_rates: BIMcloud error codes with their chances, eg. { 4: 0.01, 11: 0.01 }, answered as 430 responses
+	#   in the Manager or the Blob Server error format, depending on the url,
+	# url_pattern: regular expression, only matching urls are shaped.
+	# Several middlewares could be stacked with different url patterns (eg. error 9 for get-blob-changes-for-sync only).
+	def __init__(self, latency=0, jitter=0, bandwidth=None, unavailable_rate=0, retry_after=None, reset_rate=0, reset_after_send=False, error_rates=None, url_pattern=None, seed=None):
+		self.latency = latency
+		self.jitter = jitter
+		self.bandwidth = bandwidth
+		self.unavailable_rate = unavailable_rate
+		self.retry_after = retry_after
+		self.reset_rate = reset_rate
+		self.reset_after_send = reset_after_send
+		self.error_rates = dict(error_rates or {})
+		self._url_pattern = re.compile(url_pattern) if url_pattern is not None else None
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+		# Number of injected faults by kind ('unavailable', 'reset', or the error code).
+		self.injected = {}
+
+	def __call__(self, request, send):
+		if self._url_pattern is not None and not self._url_pattern.search(request.url):
+			return send(request)
+
+		delay = self.latency + (self._chance() * self.jitter if self.jitter else 0)
+		if self.bandwidth:
+			delay += get_request_size(request) / self.bandwidth
+		if delay:
+			time.sleep(delay)
+
+		if not self.reset_after_send and self._roll(self.reset_rate, 'reset'):
+			raise requests.ConnectionError(ConnectionResetError(104, 'Connection reset by peer (shaped).'))
+		if self._roll(self.unavailable_rate, 'unavailable'):
+			headers = { 'Retry-After': str(self.retry_after) } if self.retry_after is not None else None
+			return create_response(request, 503, 'Service Unavailable', b'Server unavailable, retry the request later.', headers)
+		for code, rate in self.error_rates.items():
+			if self._roll(rate, code):
+				return create_response(request, 430, 'BIMcloud Error', ShapingMiddleware.create_error_content(request.url, code))
+
+		response = send(request)
+		if self.reset_after_send and self._roll(self.reset_rate, 'reset'):
+			response.close()
+			raise requests.ConnectionError(ConnectionResetError(104, 'Connection reset by peer (shaped).'))
+		if self.bandwidth:
+			if request.kwargs.get('stream'):
+				response.raw = _ThrottledStream(response.raw, self.bandwidth)
+			else:
+				time.sleep(len(response.content or b'') / self.bandwidth)
+		return response
+
+	def _chance(self):
+		with self._lock:
+			return self._random.random()
+
+	def _roll(self, rate, kind):
+		if not rate or self._chance() >= rate:
+			return False
+		with self._lock:
+			self.injected[kind] = self.injected.get(kind, 0) + 1
+		return True
+
+	@staticmethod
+	def create_error_content(url, code):
+		# Manager errors are flat, Blob Server errors are wrapped in "data".
+		error = { 'error-code': code, 'error-message': f'Shaped error {code}.' }
+		return error if '/management/' in url else { 'data': error }
+
+class _ThrottledStream:
+	# Wraps the raw stream of a streamed response, so reading it doesn't go faster than the bandwidth.
+	def __init__(self, raw, bandwidth):
+		self._raw = raw
+		self._bandwidth = bandwidth
+
+	def read(self, *args, **kwargs):
+		data = self._raw.read(*args, **kwargs)
+		if data:
+			time.sleep(len(data) / self._bandwidth)
+		return data
+
+	def readinto(self, buffer):
+		size = self._raw.readinto(buffer)
+		if size:
+			time.sleep(size / self._bandwidth)
+		return size
+
+	def stream(self, amt=2 ** 16, decode_content=None):
+		for data in self._raw.stream(amt, decode_content=decode_content):
+			time.sleep(len(data) / self._bandwidth)
+			yield data
+
+	def __getattr__(self, name):
+		return getattr(self._raw, name)
@@ -0,0 +1,92 @@
+import io
+import json
+import requests
+from .httpsession import create_http_session
+
+class TransportRequest:
+	def __init__(self, method, url, kwargs):
+		# kwargs: requests keyword arguments (params, json, data, headers, timeout, stream, verify...).
+		self.method = method
+		self.url = url
+		self.kwargs = kwargs
+
+class Transport:
+	# Sends the requests of the API classes. It has the request methods of requests.Session,
+	# and runs every request through a chain of middlewares.
+	# A middleware is a callable: middleware(request, send) -> response,
+	# it could change the request, call send(request) any number of times (or not at all), and change or replace the response.
+	# Middlewares run in order, the first one is the outermost.
+	def __init__(self, session=None, middlewares=None, options=None):
+		self.session = session if session is not None else create_http_session(options)
+		self.middlewares = list(middlewares or [])
+
+	def request(self, method, url, **kwargs):
+		send = self._send
+		for middleware in reversed(self.middlewares):
+			send = Transport._bind(middleware, send)
+		return send(TransportRequest(method, url, kwargs))
+
+	def get(self, url, **kwargs):
+		return self.request('GET', url, **kwargs)
+
+	def post(self, url, **kwargs):
+		return self.request('POST', url, **kwargs)
+
+	def put(self, url, **kwargs):
+		return self.request('PUT', url, **kwargs)
+
+	def delete(self, url, **kwargs):
+		return self.request('DELETE', url, **kwargs)
+
+	def close(self):
+		self.session.close()
+
+	def _send(self, request):
+		return self.session.request(request.method, request.url, **request.kwargs)
+
+	@staticmethod
+	def _bind(middleware, send):
+		return lambda request: middleware(request, send)
+
+def create_transport(options=None, session=None):
+	# session: a requests.Session to send through, or a readily configured Transport.
+	if isinstance(session, Transport):
+		return session
+	if options is None:
+		return Transport(session)
+	# Retries are the outermost, so every attempt goes through the metrics and the rest of the middlewares.
+	middlewares = [options.retry_policy.bind(options.metrics)]
+	if options.metrics is not None:
+		middlewares.append(options.metrics.middleware)
+	middlewares += options.middlewares
+	return Transport(session, middlewares, options)
+
+def create_response(request, status_code, reason, content=b'', headers=None):
+	# A response which never reached the wire, for middlewares answering on their own.
+	response = requests.Response()
+	response.status_code = status_code
+	response.reason = reason
+	response.url = request.url
+	if isinstance(content, (dict, list)):
+		content = json.dumps(content).encode('utf-8')
+		response.headers['Content-Type'] = 'application/json'
+	response._content = content
+	response._content_consumed = True
+	response.raw = io.BytesIO(content)
+	response.encoding = 'utf-8'
+	if headers is not None:
+		response.headers.update(headers)
+	return response
+
+def get_request_size(request):
+	# Size of the request body in bytes, form fields are estimated.
+	data = request.kwargs.get('data')
+	if isinstance(data, (bytes, bytearray, memoryview)):
+		return len(data)
+	if isinstance(data, str):
+		return len(data.encode('utf-8'))
+	if isinstance(data, dict):
+		return sum(len(str(key)) + len(str(value)) + 2 for key, value in data.items())
+	if request.kwargs.get('json') is not None:
+		return len(json.dumps(request.kwargs['json']))
+	return 0
@@ -0,0 +1,151 @@
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from .contenthash import DEFAULT_CONTENT_HASH_ALGORITHM, create_hasher, encode_digest, decode_content_hash
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+DEFAULT_MANIFEST_PATH = os.path.join(os.path.expanduser('~'), '.bimcloud-api', 'push-manifest.json')
+
+def hash_file(path, content_hash_algorithm=DEFAULT_CONTENT_HASH_ALGORITHM):
+	hasher = create_hasher(content_hash_algorithm)
+	with open(path, 'rb') as f:
+		while True:
+			chunk = f.read(HASH_BUFFER_SIZE)
+			if not chunk:
+				break
+			hasher.update(chunk)
+	return encode_digest(hasher.digest())
+
+def list_local_tree(local_dir):
+	# Relative paths use "/" separators, like resource paths on the server.
+	result = []
+	for dir_path, _, file_names in os.walk(local_dir):
+		for file_name in file_names:
+			relative_path = os.path.relpath(os.path.join(dir_path, file_name), local_dir)
+			result.append(relative_path.replace(os.sep, '/'))
+	result.sort()
+	return result
+
+def hash_local_tree(local_dir, max_workers=None):
+	# Hashing is CPU bound, so it runs in a process pool.
+	relative_paths = list_local_tree(local_dir)
+	full_paths = [os.path.join(local_dir, *relative_path.split('/')) for relative_path in relative_paths]
+	with ProcessPoolExecutor(max_workers=max_workers) as executor:
+		hashes = list(executor.map(hash_file, full_paths, chunksize=max(1, len(full_paths) // 64)))
+	return dict(zip(relative_paths, hashes))
+
+def get_resource_content_hash(resource):
+	for key in ('content-hash', 'contentHash', '$contentHash'):
+		value = resource.get(key)
+		if value:
+			return value
+	return None
+
+def get_committed_blobs(committed):
+	# Blob id -> standard metadata of the blobs in a commit_batch_upload result, which have a content hash of the default algorithm.
+	result = {}
+	for metadata in committed:
+		metadata = metadata.get('standard-metadata', metadata)
+		blob_id = metadata.get('blob-id')
+		if blob_id and metadata.get('content-hash') and metadata.get('content-hash-algorithm', DEFAULT_CONTENT_HASH_ALGORITHM) == DEFAULT_CONTENT_HASH_ALGORITHM:
+			result[blob_id] = metadata
+	return result
+
+class PushManifest:
+	# Manager resources don't carry content hashes, so the hashes reported by the Blob Server on commit
+	# (see BatchUploader.committed) are recorded in a small JSON file by blob id, along with the $size and $modifiedDate
+	# of the blob right after the commit. A recorded hash is trusted only while the blob has the same $size and $modifiedDate,
+	# so changes by other clients make the file compared as unknown again.
+	def __init__(self, path=DEFAULT_MANIFEST_PATH):
+		self.path = path
+		self._lock = threading.Lock()
+		self.entries = self._load()
+
+	def get_content_hash(self, blob):
+		with self._lock:
+			entry = self.entries.get(blob['id'])
+			if entry is None or entry.get('modifiedDate') is None:
+				return None
+			if blob.get('$size') != entry['size'] or blob.get('$modifiedDate') != entry['modifiedDate']:
+				return None
+			return entry['contentHash']
+
+	def record(self, committed, resources):
+		# committed: blob metadata list, as returned by commit_batch_upload,
+		# resources: blob id -> Manager resource of the committed blobs, fetched after the commit.
+		# Blobs without their resource, or changed since the commit (other size) are left out, they're compared as unknown.
+		with self._lock:
+			for blob_id, metadata in get_committed_blobs(committed).items():
+				resource = resources.get(blob_id)
+				size = int(metadata['size']) if metadata.get('size') is not None else None
+				if resource is None or resource.get('$modifiedDate') is None or (size is not None and resource.get('$size') != size):
+					self.entries.pop(blob_id, None)
+					continue
+				self.entries[blob_id] = { 'contentHash': metadata['content-hash'], 'size': resource.get('$size'), 'modifiedDate': resource['$modifiedDate'], 'path': resource['$path'] }
+
+	def prune(self, path, blob_ids):
+		# Drops the entries of blobs under the server directory path which are not there anymore (blob_ids: blobs of the walked tree).
+		prefix = path.rstrip('/').lower() + '/'
+		blob_ids = set(blob_ids)
+		with self._lock:
+			for blob_id in [blob_id for blob_id, entry in self.entries.items() if blob_id not in blob_ids and (entry.get('path') is None or entry['path'].lower().startswith(prefix))]:
+				del self.entries[blob_id]
+
+	def save(self):
+		if self.path is None:
+			return
+		with self._lock:
+			manifest_dir = os.path.dirname(os.path.abspath(self.path))
+			os.makedirs(manifest_dir, exist_ok=True)
+			fd, temp_path = tempfile.mkstemp(dir=manifest_dir, suffix='.tmp')
+			try:
+				with os.fdopen(fd, 'w', encoding='utf-8') as f:
+					json.dump(self.entries, f)
+				os.replace(temp_path, self.path)
+			except:
+				os.remove(temp_path)
+				raise
+
+	def _load(self):
+		if self.path is None or not os.path.isfile(self.path):
+			return {}
+		try:
+			with open(self.path, 'r', encoding='utf-8') as f:
+				entries = json.load(f)
+		except (OSError, ValueError):
+			return {}
+		return entries if isinstance(entries, dict) else {}
+
+class PushPlan:
+	def __init__(self):
+		# Relative paths of new or changed files.
+		self.changed = []
+		# Files on the server with the same size, but without a known content hash to compare with. These are pushed as changed.
+		self.unverified = []
+
+def plan_push(local_hashes, remote_blobs, local_sizes=None, manifest=None):
+	# remote_blobs: relative path -> blob resource. Paths are compared case insensitively, as the server does.
+	# A different $size means a change without comparing hashes. Server side hashes come from the resource or the PushManifest.
+	remote_by_lowered_path = { path.lower(): blob for path, blob in remote_blobs.items() }
+	result = PushPlan()
+	for relative_path, local_hash in local_hashes.items():
+		blob = remote_by_lowered_path.get(relative_path.lower())
+		if blob is None:
+			result.changed.append(relative_path)
+			continue
+		if local_sizes is not None and blob.get('$size') is not None and blob['$size'] != local_sizes.get(relative_path):
+			result.changed.append(relative_path)
+			continue
+		remote_hash = get_resource_content_hash(blob)
+		if remote_hash is None and manifest is not None:
+			remote_hash = manifest.get_content_hash(blob)
+		remote_digest = decode_content_hash(remote_hash) if remote_hash else None
+		if remote_digest is None:
+			result.unverified.append(relative_path)
+			result.changed.append(relative_path)
+		elif remote_digest != decode_content_hash(local_hash):
+			result.changed.append(relative_path)
+	return result
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+PRE_ORDER = 'pre'
+POST_ORDER = 'post'
+
+class TreeWalker:
+	# Walks a directory tree by listing subdirectories concurrently.
+	# Resources are yielded as soon as their parent directory is listed, so consumers can start working before the walk ends.
+	# Pre-order yields directories before their content, post-order yields them after their whole subtree.
+	def __init__(self, manager_api, auth_context, max_workers=8, page_size=100):
+		self._manager_api = manager_api
+		self._auth_context = auth_context
+		self._max_workers = max_workers
+		self._page_size = page_size
+
+	def list_directory(self, directory_id):
+		# All query APIs have default result limit of 1000 items, so contents are fetched page by page.
+		criterion = { '$eq': { '$parentId': directory_id } }
+		return list(self._manager_api.iter_resources_by_criterion(self._auth_context, criterion, page_size=self._page_size))
+
+	def walk(self, root, order=PRE_ORDER, max_depth=None, types=None, include_root=False):
+		# root: a resourceGroup resource, its children are on depth 1.
+		# types: resource types to yield (eg. ['blob']), None yields every type.
+		if order not in (PRE_ORDER, POST_ORDER):
+			raise ValueError(f'Unknown order "{order}".')
+
+		def accepted(resource):
+			return types is None or resource['type'] in types
+
+		if include_root and order == PRE_ORDER and accepted(root):
+			yield root
+		if max_depth is not None and max_depth < 1:
+			if include_root and order == POST_ORDER and accepted(root):
+				yield root
+			return
+
+		# Post-order bookkeeping: directories with unfinished subtrees, and their parents.
+		remaining = { root['id']: 1 }
+		parents = { root['id']: None }
+		directories = { root['id']: root }
+
+		def complete(directory_id):
+			# Yields directories whose subtree has been walked completely, bottom-up.
+			while directory_id is not None:
+				remaining[directory_id] -= 1
+				if remaining[directory_id]:
+					return
+				del remaining[directory_id]
+				directory = directories.pop(directory_id)
+				if order == POST_ORDER and (directory_id != root['id'] or include_root) and accepted(directory):
+					yield directory
+				directory_id = parents.pop(directory_id)
+
+		with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+			in_flight = { executor.submit(self.list_directory, root['id']): (root, 0) }
+			try:
+				while in_flight:
+					done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+					for future in done:
+						directory, depth = in_flight.pop(future)
+						content = future.result()
+						for resource in content:
+							if resource['type'] != 'resourceGroup':
+								if accepted(resource):
+									yield resource
+								continue
+
+							if order == PRE_ORDER and accepted(resource):
+								yield resource
+							if max_depth is None or depth + 1 < max_depth:
+								remaining[directory['id']] += 1
+								remaining[resource['id']] = 1
+								parents[resource['id']] = directory['id']
+								directories[resource['id']] = resource
+								in_flight[executor.submit(self.list_directory, resource['id'])] = (resource, depth + 1)
+							elif order == POST_ORDER and accepted(resource):
+								yield resource
+						yield from complete(directory['id'])
+			finally:
+				for future in in_flight:
+					future.cancel()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from .errors import BIMcloudBlobServerError
+
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.bimcloud-api', 'uploads')
+
+# 14: UploadSessionNotFound, 15: IncompleteUpload
+UPLOAD_LOST_ERROR_CODES = (14, 15)
+
+def get_source_fingerprint(source_path):
+	# A changed file can't be continued, its already uploaded parts could be stale.
+	stat = os.stat(source_path)
+	return {
+		'path': os.path.abspath(source_path),
+		'size': stat.st_size,
+		'mtimeNs': stat.st_mtime_ns
+	}
+
+def get_journal_path(journal_dir, source_path, path):
+	key = f'{os.path.abspath(source_path)}\n{path}'.encode('utf-8')
+	return os.path.join(journal_dir, hashlib.sha256(key).hexdigest() + '.json')
+
+class UploadJournal:
+	# Upload state persisted in a small JSON file: batch id, upload id, source fingerprint and acknowledged parts.
+	# Every change is written to a temporary file first and renamed, so a crash never leaves a half written journal.
+	def __init__(self, path):
+		self.path = path
+		self._lock = threading.Lock()
+		self.state = None
+
+	def load(self):
+		if not os.path.isfile(self.path):
+			return None
+		try:
+			with open(self.path, 'r', encoding='utf-8') as f:
+				self.state = json.load(f)
+		except (OSError, ValueError):
+			self.state = None
+		return self.state
+
+	def start(self, state):
+		with self._lock:
+			self.state = dict(state, acknowledged=[])
+			self._save()
+
+	def update(self, **values):
+		with self._lock:
+			self.state.update(values)
+			self._save()
+
+	def acknowledge(self, offset, length):
+		with self._lock:
+			self.state['acknowledged'].append([offset, length])
+			self._save()
+
+	def clear(self):
+		with self._lock:
+			self.state = None
+			try:
+				os.remove(self.path)
+			except FileNotFoundError:
+				pass
+
+	def _save(self):
+		journal_dir = os.path.dirname(os.path.abspath(self.path))
+		os.makedirs(journal_dir, exist_ok=True)
+		fd, temp_path = tempfile.mkstemp(dir=journal_dir, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'w', encoding='utf-8') as f:
+				json.dump(self.state, f)
+			os.replace(temp_path, self.path)
+		except:
+			os.remove(temp_path)
+			raise
+
+class ResumableUpload:
+	# Uploads a file in its own batch, so that a restarted process can continue where the previous one stopped.
+	# Only the missing parts are sent again. The upload starts over only if the server has lost it.
+	def __init__(self, journal_path, source_path, path, description='', conflict_behavior='overwrite'):
+		self._journal = UploadJournal(journal_path)
+		self._source_path = source_path
+		self._path = path
+		self._description = description
+		self._conflict_behavior = conflict_behavior
+
+	def run(self, session_id, blob_server_api, chunk_size=None, max_workers=4, max_part_attempts=3):
+		# Returns the committed blobs, as commit_batch_upload does.
+		journal = self._journal
+		fingerprint = get_source_fingerprint(self._source_path)
+		state = journal.load()
+		if state is not None and state.get('fingerprint') == fingerprint and state.get('path') == self._path:
+			try:
+				return self._continue(session_id, blob_server_api, chunk_size, max_workers, max_part_attempts)
+			except BIMcloudBlobServerError as err:
+				if err.code not in UPLOAD_LOST_ERROR_CODES:
+					raise err
+
+		journal.clear()
+		batch = blob_server_api.begin_batch_upload(session_id, self._description)
+		upload = blob_server_api.begin_upload(session_id, self._path, batch['namespace-name'])
+		journal.start({
+			'fingerprint': fingerprint,
+			'path': self._path,
+			'batchId': batch['id'],
+			'uploadId': upload['id'],
+			'uploadCommitted': False
+		})
+		return self._continue(session_id, blob_server_api, chunk_size, max_workers, max_part_attempts)
+
+	def _continue(self, session_id, blob_server_api, chunk_size, max_workers, max_part_attempts):
+		journal = self._journal
+		state = journal.state
+		if not state['uploadCommitted']:
+			blob_server_api.upload_blob_content(session_id, state['uploadId'], self._source_path, chunk_size, max_workers, max_part_attempts,
+				acknowledged=state['acknowledged'],
+				on_part=journal.acknowledge)
+			blob_server_api.commit_upload(session_id, state['uploadId'])
+			journal.update(uploadCommitted=True)
+		result = blob_server_api.commit_batch_upload(session_id, state['batchId'], self._conflict_behavior)
+		journal.clear()
+		return result
@@ -32,4 +32,8 @@ def is_url(url):
 		return False
 
 def parse_url(url):
-	return urlparse(url)
\ No newline at end of file
+	return urlparse(url)
+
+def get_endpoint(url):
+	# 'https://manager/management/client/get-resource?resource-id=x' -> 'management/client/get-resource'
+	return urlparse(url).path.strip('/')
@@ -1,15 +1,27 @@
+import contextlib
 import datetime
 import random
 import string
 import itertools
 import os
-import requests
 import time
 import json
-from .managerapi import ManagerApi
+import tempfile
+from .managerapi import ManagerApi, TokenRefresher
 from .blobserverapi import BlobServerApi
-from .url import join_url, parse_url
-from .errors import BIMcloudBlobServerError, BIMcloudManagerError
+from .blobserversessionpool import BlobServerSessionPool
+from .batchuploader import BatchUploader
+from .treepush import hash_local_tree, plan_push, get_committed_blobs, PushManifest, DEFAULT_MANIFEST_PATH as DEFAULT_PUSH_MANIFEST_PATH
+from .mirror import Mirror
+from .treewalker import TreeWalker, POST_ORDER
+from .pathresolver import PathResolver
+from .jobwaiter import JobWaiter
+from .bulkdelete import BulkDeleter
+from .downloadscheduler import DownloadScheduler
+from .uploadjournal import ResumableUpload, get_journal_path, DEFAULT_JOURNAL_DIR as DEFAULT_UPLOAD_JOURNAL_DIR
+from .modelserverlocator import ModelServerUrlSelector, DEFAULT_CACHE_PATH as DEFAULT_MODEL_SERVER_URL_CACHE_PATH
+from .url import join_url
+from .errors import BIMcloudManagerError
 import uuid
 
 CHARS = list(itertools.chain(string.ascii_lowercase, string.digits))
@@ -17,39 +29,58 @@ PROJECT_ROOT = 'Project Root'
 PROJECT_ROOT_ID = 'projectRoot'
 
 class Workflow:
-	def __init__(self, manager_url, client_id):
-		self._manager_api = ManagerApi(manager_url)
+	def __init__(self, manager_url, client_id, http_options=None, resource_cache=None, model_server_url_cache_path=DEFAULT_MODEL_SERVER_URL_CACHE_PATH, upload_journal_dir=DEFAULT_UPLOAD_JOURNAL_DIR, push_manifest_path=DEFAULT_PUSH_MANIFEST_PATH):
+		# Every API instance owns a keep-alive connection pool,
+		# so repeated calls to the same server reuse their TCP/TLS connections.
+		# An optional ResourceCache saves repeated metadata lookups (eg. the same Model Server for every blob).
+		self._http_options = http_options
+		self._manager_api = ManagerApi(manager_url, http_options=http_options, cache=resource_cache)
 
 		self.client_id = client_id
 		self.username= None
 
 		self._auth_context = None
+		self._token_refresher = None
 
 		self._root_dir_name = Workflow.to_unique('DEMO_RootDir')
 		self._sub_dir_name = Workflow.to_unique('DEMO_SubDir')
 		self._root_dir_data = None
 		self._sub_dir_data = None
 		self._inner_dir_path = None
-		self._model_server_urls = {}
-		self._blob_server_sessions = {}
+		self._model_server_url_selector = ModelServerUrlSelector(manager_url, cache_path=model_server_url_cache_path)
+		self._upload_journal_dir = upload_journal_dir
+		self._push_manifest_path = push_manifest_path
+		self._blob_server_session_pool = None
 
 		# Changeset polling starts on revision 0
 		self._next_revision_for_sync = 0
 
 	def run(self):
 		# WORKFLOW BEGIN
-		self.login_sso()
+		# With metrics (see HttpSessionOptions), time spent in every phase is recorded as well.
+		with self.phase('login'):
+			self.login_sso()
 		try:
-			self.create_dirs()
-			self.upload_files()
-			self.rename_file()
-			self.move_file()
-			self.locate_download_and_delete_files()
-			self.create_directory_tree_and_delete_recursively()
+			with self.phase('create_dirs'):
+				self.create_dirs()
+			with self.phase('upload_files'):
+				self.upload_files()
+			with self.phase('rename_file'):
+				self.rename_file()
+			with self.phase('move_file'):
+				self.move_file()
+			with self.phase('locate_download_and_delete_files'):
+				self.locate_download_and_delete_files()
+			with self.phase('create_directory_tree_and_delete_recursively'):
+				self.create_directory_tree_and_delete_recursively()
 		finally:
 			self.logout()
 		# WORKFLOW END
 
+	def phase(self, name):
+		metrics = self._http_options.metrics if self._http_options is not None else None
+		return metrics.phase(name) if metrics is not None else contextlib.nullcontext()
+
 	def login_sso(self):
 		print('Logging in ...')
 		state = uuid.uuid4()
@@ -77,8 +108,14 @@ class Workflow:
 		print(f'Access token is going to expire at {Workflow.convert_timestamp(self._auth_context.access_token_exp)}')
 		print('Logged in.')
 
+		# Access token gets refreshed in the background before it expires,
+		# so requests don't have to run into 401 errors first.
+		self._token_refresher = TokenRefresher(self._manager_api, self._auth_context).start()
+
 		self.username = self._manager_api.get_user(self._auth_context, self._auth_context.user_id)['username']
 
+		self._blob_server_session_pool = BlobServerSessionPool(self._manager_api, self._auth_context, self.username, self._model_server_url_selector, self._http_options)
+
 	def create_dirs(self):
 		print('Creating directories ...')
 		self._root_dir_data = self.get_or_create_dir(self._root_dir_name)
@@ -112,9 +149,6 @@ class Workflow:
 		description = f'\nUploading file "{file_path}" to "{path}/{alias}" ...'
 		print(description)
 
-		data = None
-		with open(file_path, 'rb') as f: data = f.read()
-
 		# To know to which File Server we should upload the file,
 		# we should get the setting.
 		immediate_parent_dir = self.find_immediate_parent_dir(path)
@@ -135,30 +169,96 @@ class Workflow:
 			print('Uploading data ...')
 
 			# For more efficient uploads, we could use one batch for many upload operations,
-			# and commit them together.
+			# and commit them together (see BatchUploader in batchuploader.py).
 			# But for the sake of simplicity, we open a batch for every upload for now.
-			batch = blob_server_api.begin_batch_upload(blob_server_session_id, description)
 
 			# We should extract the manager side mandatory "Project Root" prefix:
 			blob_server_file_path = self.create_blob_server_path(path, alias)
 
-			upload = blob_server_api.begin_upload(blob_server_session_id, blob_server_file_path, batch['namespace-name'])
-
 			# It is advised to upload large content in chunks.
-			CHUNK_SIZE = 1024 * 40 # NOTE: We use 40Kb for the DEMO but in real life it should be around several megabytes!
-			offset = 0
-			while offset < len(data):
-				chunk = data[offset:offset + CHUNK_SIZE]
-				blob_server_api.put_blob_content_part(blob_server_session_id, upload['id'], chunk, offset=offset)
-				offset += CHUNK_SIZE
-
-			blob_server_api.commit_upload(blob_server_session_id, upload['id'])
-			blob_server_api.commit_batch_upload(blob_server_session_id, batch['id'])
+			# Chunks carry their offset, so they are sent concurrently, and the upload is committed when every chunk has arrived.
+			# Chunk size is tuned per Blob Server: it grows while the throughput improves, and shrinks on timeouts
+			# (see AdaptiveChunkSizer in chunksizer.py), so the same code fits both LAN and remote servers.
+			# Acknowledged chunks are recorded in a journal file, so an interrupted upload continues
+			# with the missing chunks when it's started again (see ResumableUpload in uploadjournal.py).
+			journal_path = get_journal_path(self._upload_journal_dir, file_path, blob_server_file_path)
+			upload = ResumableUpload(journal_path, file_path, blob_server_file_path, description)
+			upload.run(blob_server_session_id, blob_server_api)
 
 			print(f'File uploaded as "{blob_server_file_path}".')
 
 		self.run_with_blob_server_session(model_server, do_upload)
 
+	def push_tree(self, local_dir, path):
+		# Uploads a local directory tree to a server directory, skipping files whose content is already there.
+		path = self.ensure_root(path)
+		print(f'\nPushing "{local_dir}" to "{path}" ...')
+
+		# Local files are hashed in parallel, server side blobs come in bulk by paginated queries.
+		# Manager resources have no content hash, blobs of the same size are compared with the hashes
+		# the Blob Server reported when they were pushed last time (see PushManifest).
+		local_hashes = hash_local_tree(local_dir)
+		local_sizes = { relative_path: os.path.getsize(os.path.join(local_dir, *relative_path.split('/'))) for relative_path in local_hashes }
+		remote_blobs = self.get_blobs_under(path)
+		manifest = PushManifest(self._push_manifest_path)
+		manifest.prune(path, [blob['id'] for blob in remote_blobs.values()])
+		plan = plan_push(local_hashes, remote_blobs, local_sizes, manifest)
+		changed = plan.changed
+		print(f'{len(changed)} of {len(local_hashes)} files are new or changed.')
+		if plan.unverified:
+			print(f'{len(plan.unverified)} of them have the same size on the server, but couldn\'t be compared, as their content hash is unknown.')
+
+		# Files of a directory go to the configured Blob Server of their immediate existing parent directory.
+		dir_paths = { relative_path: join_url(path, *relative_path.split('/')[:-1]) for relative_path in changed }
+		immediate_parent_dirs = PathResolver(self._manager_api, self._auth_context).find_immediate_parent_dirs(list(set(dir_paths.values())))
+		model_servers = {}
+		files_by_model_server = {}
+		for relative_path in changed:
+			dir_path = dir_paths[relative_path]
+			model_server = model_servers.get(dir_path)
+			if model_server is None:
+				immediate_parent_dir = immediate_parent_dirs[dir_path]
+				configured_blob_server_id = self._manager_api.get_inherited_default_blob_server_id(self._auth_context, immediate_parent_dir['id'])
+				model_server = self._manager_api.get_resource_by_id(self._auth_context, configured_blob_server_id)
+				model_servers[dir_path] = model_server
+			files_by_model_server.setdefault(model_server['id'], (model_server, []))[1].append((dir_path, relative_path))
+
+		for model_server, files in files_by_model_server.values():
+			def do_upload(blob_server_session_id, blob_server_api, files=files):
+				with BatchUploader(blob_server_api, blob_server_session_id, f'Pushing "{local_dir}"') as uploader:
+					for dir_path, relative_path in files:
+						blob_server_file_path = self.create_blob_server_path(dir_path, relative_path.split('/')[-1])
+						uploader.add(blob_server_file_path, os.path.join(local_dir, *relative_path.split('/')))
+				# The $modifiedDate of the pushed blobs is recorded with their hashes, it tells later changes apart.
+				committed = uploader.committed
+				manifest.record(committed, self.get_resources_by_ids(list(get_committed_blobs(committed))))
+
+			self.run_with_blob_server_session(model_server, do_upload)
+
+		manifest.save()
+		print(f'Pushed {len(changed)} files.')
+		return changed
+
+	def get_resources_by_ids(self, resource_ids):
+		# Returns resources by their ids with a single query (paginated above MAX_RESULT_LIMIT results).
+		if not resource_ids:
+			return {}
+		criterion = { '$or': [{ '$eq': { 'id': resource_id } } for resource_id in resource_ids] }
+		return { resource['id']: resource for resource in self._manager_api.iter_resources_by_criterion(self._auth_context, criterion) }
+
+	def get_blobs_under(self, path):
+		# Returns every blob in the subtree of a directory by their paths relative to the directory.
+		criterion = {
+			'$and': [
+				{ '$eq': { 'type': 'blob' } },
+				{ '$like': { '$path': join_url(path, '%') } }
+			]
+		}
+		result = {}
+		for blob in self._manager_api.iter_resources_by_criterion(self._auth_context, criterion):
+			result[blob['$path'][len(path) + 1:]] = blob
+		return result
+
 	def rename_file(self):
 		print('\nRenaming a file ...')
 
@@ -196,51 +296,41 @@ class Workflow:
 		self.locate_download_and_delete_files_in(self._root_dir_data, True)
 
 	def locate_download_and_delete_files_in(self, directory, get_changes=False):
-		directory_id = directory['id']
 		directory_path = directory['$path']
 
 		print(f'\nGetting content of directory "{directory_path}".')
 
 		# To look up content of a directory, we get all resources
-		# which have parents set as the directory.
-
-		criterion = { '$eq': { '$parentId': directory_id } }
-
-		# All query APIs have default result limit of 1000 items,
-		# so you should get contents of directories by using pagination.
-		limit = 100 # Keep it reasonably small.
-		options = {
-			'sort-by': 'name',
-			'skip': 0,
-			'limit': limit
-		}
-		all_content = []
-		while True:
-			content = self._manager_api.get_resources_by_criterion(self._auth_context, criterion, options)
-			all_content.extend(content)
-			if len(content) < limit:
-				break
-			options['skip'] += limit
-
-		if not all_content:
-			print('Directory has no content.')
-			return
-
-		print(f'Directory has {len(all_content)} resources.')
+		# which have parents set as the directory (see TreeWalker.list_directory).
+		# Subdirectories get listed concurrently, and resources are processed as soon as they are found.
+		walker = TreeWalker(self._manager_api, self._auth_context)
+		content = []
+		def walk():
+			for resource in walker.walk(directory, POST_ORDER):
+				content.append(resource)
+				yield resource
+
+		# Blobs get downloaded while the rest of the tree is being listed.
+		with tempfile.TemporaryDirectory() as local_dir:
+			# Type of file is 'blob' in BIMcloud.
+			self.download_files((resource for resource in walk() if resource['type'] == 'blob'), directory_path, local_dir)
 
 		# Type of directory is 'resourceGroup' in BIMcloud.
-		for subdir in filter(lambda i: i['type'] == 'resourceGroup', all_content):
-			self.locate_download_and_delete_files_in(subdir)
+		directory_count = sum(1 for resource in content if resource['type'] == 'resourceGroup')
+		print(f'\nDirectory has {len(content)} resources, {directory_count} of them are directories.')
 
-		# Type of file is 'blob' in BIMcloud.
-		for blob in filter(lambda i: i['type'] == 'blob', all_content):
-			self.download_and_delete_file(blob)
+		# Instead of deleting resources one by one, the entire content is deleted with a few jobs.
+		# Resources under selected directories are left out of the request, as their directory takes them anyway.
+		if content:
+			report = BulkDeleter(self._manager_api, self._auth_context).delete(resources=content)
+			print(f'\n{len(content)} resources deleted with {len(report.jobs)} job(s). Result codes: {dict(report.result_codes)}.')
+			if not report.succeeded:
+				raise RuntimeError(f'Failed to delete content of directory "{directory_path}".')
 
 		if get_changes:
 			self.wait_for_blob_changes()
 
-		# We do this at last, because non-empty directories cannot get deleted (easily).
-		self._manager_api.delete_resource_group(self._auth_context, directory_id)
+		self._manager_api.delete_resource_group(self._auth_context, directory['id'])
 		print(f'\nDirectory "{directory_path}" deleted.')
 
 	def create_directory_tree_and_delete_recursively(self):
@@ -274,10 +364,13 @@ class Workflow:
 
 		print(f'Job has been started. Id: {job["id"]}, type: {job["jobType"]}.')
 		print('\nWaiting to job get completed.')
-		while job['status'] != 'completed' and job['status'] != 'failed':
-			print(f'Job stauts is {job["status"]}, polling ...')
-			time.sleep(0.1)
-			job = self._manager_api.get_job(self._auth_context, job['id'])
+		# Job waiter polls with increasing intervals while the job makes no progress,
+		# and it could track many jobs at once.
+		def on_progress(job):
+			print(f'Job stauts is {job["status"]}, progress: {json.dumps(job["progress"])}')
+
+		with JobWaiter(self._manager_api, self._auth_context) as job_waiter:
+			job = job_waiter.wait_for(job, on_progress).result()
 
 		if job['status'] == 'completed':
 			print('Job has been completed successfully.')
@@ -285,94 +378,42 @@ class Workflow:
 			print('Progress:')
 			print(json.dumps(job['progress'], sort_keys=False, indent=4))
 		else:
-			assert job['status'] == 'failed'
 			print(f'Job has been falied. Erro code: {job["resultCode"]}, error message: {job["result"]}.')
 
-	def download_and_delete_file(self, blob):
-		blob_id = blob['id']
-		blob_path = blob['$path']
-
-		blob_model_server_id = blob['modelServerId']
-		blob_model_server = self._manager_api.get_resource_by_id(self._auth_context, blob_model_server_id)
-
-		def download(blob_server_session_id, blob_server_api):
-			print(f'\nDownloading "{blob_path}".')
-			stream = blob_server_api.get_blob_content(blob_server_session_id, blob_id)
-			first_byte = None
-			last_byte = None
-			size = 0
-			for chunk in stream.iter_content(chunk_size=8192):
-				if chunk:
-					size += len(chunk)
-					if not first_byte:
-						first_byte = chunk[0]
-					last_byte = chunk[-1]
-			print(f'Downloaded {size} bytes. First byte: {first_byte}, last byte: {last_byte}.')
+	def download_files(self, blobs, directory_path, local_dir):
+		# Blobs could be stored on different Model Servers (see blob['modelServerId']).
+		# The scheduler downloads from every server at once, a few blobs per server at a time,
+		# with sessions of the pool (see run_with_blob_server_session).
+		items = ((blob, os.path.join(local_dir, *blob['$path'][len(directory_path):].strip('/').split('/'))) for blob in blobs)
 
-		self.run_with_blob_server_session(blob_model_server, download)
+		def on_outcome(outcome):
+			blob_path = outcome.blob['$path']
+			if outcome.ok:
+				print(f'\nDownloaded "{blob_path}", {outcome.size} bytes. Content hash: {outcome.content_hash}.')
+			else:
+				print(f'\nFailed to download "{blob_path}": {outcome.error}')
 
-		self._manager_api.delete_blob(self._auth_context, blob_id)
-		print(f'\nBlob "{blob_path}" deleted.')
+		scheduler = DownloadScheduler(self._manager_api, self._auth_context, self.run_with_blob_server_session)
+		outcomes = scheduler.download(items, on_outcome)
+		failed = [outcome for outcome in outcomes if not outcome.ok]
+		if failed:
+			raise RuntimeError(f'Failed to download {len(failed)} of {len(outcomes)} files.')
 
 	def run_with_blob_server_session(self, model_server, fn):
-		blob_server_session_id, blob_server_api = self._blob_server_sessions.get(model_server['id'], (None, None))
-		if blob_server_session_id is None:
-			# There could be Many Model Server urls configured,
-			# to be able to accessed from different network locations.
-			# We should pick that one that we can access.
-			model_server_url = self.find_working_model_server_url(model_server)
-			blob_server_api = BlobServerApi(model_server_url)
-
-			# Ticket is an authentication token for Model (Blob) Server.
-			ticket = self._manager_api.get_ticket(self._auth_context, model_server['id'])
-
-			blob_server_session_id = blob_server_api.create_session(self.username, ticket)
-
-			self._blob_server_sessions[model_server['id']] = (blob_server_session_id, blob_server_api)
-
-		try:
-			return fn(blob_server_session_id, blob_server_api)
-		except BIMcloudBlobServerError as err:
-			if err.code == 4 or err.code == 11:
-				# Session or ticket expired, drop:
-				del self._blob_server_sessions[model_server['id']]
-				# Retry:
-				return self.run_with_blob_server_session(model_server, fn)
-			raise err
-
-	def find_working_model_server_url(self, model_server):
-		# We should cache this, because it's static and takes too long to determine:
-		result_url = self._model_server_urls.get(model_server['id'])
-		if result_url is not None:
-			return result_url
-
-		possible_urls = model_server['connectionUrls']
-		assert isinstance(possible_urls, list), '"possible_urls" is not a list.'
-		parsed_manager_url = parse_url(self._manager_api.manager_url)
-		manager_hostname = parsed_manager_url.hostname
-		manager_protocol = parsed_manager_url.scheme + ':'
-
-		# Order is important here, urls on top are most likely accessible.
-		for url in possible_urls:
-			url = url.replace('$protocol', manager_protocol)
-			url = url.replace('$hostname', manager_hostname)
-			try:
-				response = requests.get(join_url(url, 'application-server-service/get-runtime-id'))
-				if response.ok:
-					self._model_server_urls[model_server['id']] = url
-					return url
-			except:
-				pass
-		model_server_name = model_server['name']
-		raise RuntimeError(f'Model Server "{model_server_name}" is unreachable.')
+		# Blob Server sessions are pooled per Model Server (see BlobServerSessionPool).
+		# There could be Many Model Server urls configured,
+		# to be able to accessed from different network locations.
+		# The pool picks that one that we can access (see ModelServerUrlSelector),
+		# and fails over to the next one if it becomes unreachable.
+		# Urls are probed concurrently and ranked by their latency, the ranking is cached on disk as well.
+		# Ticket is an authentication token for Model (Blob) Server, the pool gets them in advance.
+		# When a session or its ticket expires, the session is dropped and fn is retried with another one.
+		return self._blob_server_session_pool.run(model_server, fn)
 
 	def find_immediate_parent_dir(self, path):
 		# We should find the immediate existing (parent) directory of an arbitrary path.
-		dir_data = self._manager_api.get_resource(self._auth_context, by_path=path, try_get=True)
-		if dir_data is None or dir_data['type'] != 'resourceGroup':
-			idx = path.rindex('/')
-			return self.find_immediate_parent_dir(path[0:idx])
-		return dir_data
+		# Every ancestor path gets queried at once, and the deepest existing directory wins.
+		return PathResolver(self._manager_api, self._auth_context).find_immediate_parent_dir(path)
 
 	def get_or_create_dir(self, name, parent=None):
 		path_of_dir = name if parent is None else join_url(parent['$path'], name)
@@ -403,12 +444,13 @@ class Workflow:
 
 	def logout(self):
 		# Since access tokens are decentralized, manager API is lack of logout methods
-		for server_id in self._blob_server_sessions:
-			session_id, api = self._blob_server_sessions[server_id]
-			api.close_session(session_id)
-		self._blob_server_sessions = {}
+		if self._token_refresher is not None:
+			self._token_refresher.stop()
+			self._token_refresher = None
+		if self._blob_server_session_pool is not None:
+			self._blob_server_session_pool.close()
+			self._blob_server_session_pool = None
 		self._auth_context = None
-		self._model_server_urls = {}
 
 	def wait_for_blob_changes(self):
 		# It migth take a couple of seconds until the next changeset appears.
@@ -447,6 +489,11 @@ class Workflow:
 				raise
 		return self._next_revision_for_sync != curr_revision
 
+	def create_mirror(self, path, local_dir, index_path=None):
+		# Unlike get_blob_changes, a mirror applies the changesets to a local folder,
+		# and persists its revision cursor between runs. Call its sync() method to poll for changes.
+		return Mirror(self._manager_api, self._auth_context, self.run_with_blob_server_session, self.ensure_root(path), local_dir, index_path)
+
 	@staticmethod
 	def create_blob_server_path(manager_dir_path, file_name):
 		return join_url(manager_dir_path[len(PROJECT_ROOT):], file_name)
@@ -0,0 +1,66 @@
+import time
+import unittest
+from benchmarks.standin import StandInServer, PROJECT_ROOT_ID
+from lib.managerapi import ManagerApi, TokenRefresher
+
+class ShortLivedTokenTest(unittest.TestCase):
+	# Tokens living less than the refresh margin (60 seconds by default).
+	def test_requests_dont_refresh_fresh_token(self):
+		with StandInServer(token_ttl=30) as server:
+			api = ManagerApi(server.url, safe=False)
+			auth_context = api.get_token_by_password_grant('user', 'password', 'client')
+			for _ in range(5):
+				api.get_resource_by_id(auth_context, PROJECT_ROOT_ID)
+			self.assertEqual(auth_context.refresh_count, 0)
+			self.assertEqual(auth_context.get_refresh_margin(60), auth_context.get_refresh_margin(15))
+			api.close()
+
+	def test_refresher_doesnt_loop(self):
+		with StandInServer(token_ttl=2) as server:
+			api = ManagerApi(server.url, safe=False)
+			auth_context = api.get_token_by_password_grant('user', 'password', 'client')
+			refresher = TokenRefresher(api, auth_context).start()
+			try:
+				time.sleep(2.5)
+			finally:
+				refresher.stop()
+			# Refreshed every second (half of the lifetime), not continuously.
+			self.assertGreaterEqual(auth_context.refresh_count, 1)
+			self.assertLessEqual(auth_context.refresh_count, 4)
+			api.get_resource_by_id(auth_context, PROJECT_ROOT_ID)
+			api.close()
+
+	def test_failed_refresh_keeps_valid_token(self):
+		with StandInServer(token_ttl=30) as server:
+			api = ManagerApi(server.url, safe=False, refresh_margin=60)
+			auth_context = api.get_token_by_password_grant('user', 'password', 'client')
+			# Issued long ago, it expires within the margin.
+			auth_context.issued_at -= 100
+			def fail(refresh_token, client_id):
+				raise ConnectionError('refresh failed')
+			api.get_token_by_refresh_token_grant = fail
+			self.assertTrue(auth_context.should_refresh(60))
+			api.get_resource_by_id(auth_context, PROJECT_ROOT_ID)
+			self.assertEqual(auth_context.refresh_count, 0)
+			# Expired: the failed refresh fails the request.
+			auth_context.access_token_exp = time.time() - 1
+			with self.assertRaises(ConnectionError):
+				api.get_resource_by_id(auth_context, PROJECT_ROOT_ID)
+			api.close()
+
+	def test_refresher_skips_token_without_expiry(self):
+		with StandInServer(token_ttl=2) as server:
+			api = ManagerApi(server.url, safe=False)
+			auth_context = api.get_token_by_password_grant('user', 'password', 'client')
+			auth_context.access_token_exp = None
+			refresher = TokenRefresher(api, auth_context, retry_delay=0.1).start()
+			try:
+				time.sleep(0.5)
+				self.assertTrue(refresher._thread.is_alive())
+			finally:
+				refresher.stop()
+			self.assertEqual(auth_context.refresh_count, 0)
+			api.close()
+
+if __name__ == '__main__':
+	unittest.main()